@@ -0,0 +1,79 @@
+import os
+import asyncio
+import threading
+import time
+from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+
+# --- Event-loop stall benchmark ---
+# sync pymongo বনাম motor দিয়ে সেভ করার সময় ইভেন্ট লুপ কতক্ষণ আটকে থাকে তা মাপা।
+# ব্যবহার: MONGO_URI=... python3 bench_db_stall.py
+# একটি আলাদা "bench_loop_stall" কালেকশনে লেখে এবং শেষে সেটি মুছে ফেলে।
+
+load_dotenv()
+
+MONGO_URI = os.environ.get("MONGO_URI")
+DB_NAME = "TA_HD_Anime"
+BENCH_COLLECTION = "bench_loop_stall"
+SAVES = int(os.environ.get("BENCH_SAVES", "50"))
+USERS = int(os.environ.get("BENCH_USERS", "20000"))
+TICK = 0.005
+
+# bot_data ডকুমেন্টের মতো আকারের একটি পেলোড
+def make_payload():
+    return {
+        "user_list": list(range(1_000_000_000, 1_000_000_000 + USERS)),
+        "filters_dict": {f"filter_{i}": {'message_text': None, 'button_data': [], 'file_ids': list(range(i * 100, i * 100 + 50))} for i in range(200)}
+    }
+
+# আলাদা থ্রেড থেকে প্রতি TICK সেকেন্ডে লুপে একটি কলব্যাক পাঠিয়ে লুপ সেটি চালাতে কতটা দেরি করল তা রেকর্ড করে।
+# লুপ ব্লক হয়ে থাকলেও থ্রেডটি চলতে থাকে, তাই ব্লকিং সেভের পুরো স্টল ধরা পড়ে।
+def monitor_thread(loop, stop_event, stalls):
+    while not stop_event.is_set():
+        handled = threading.Event()
+        before = time.perf_counter()
+        loop.call_soon_threadsafe(handled.set)
+        handled.wait()
+        stalls.append(time.perf_counter() - before)
+        time.sleep(TICK)
+
+async def run_case(name, save):
+    stalls = []
+    stop_event = threading.Event()
+    monitor = threading.Thread(target=monitor_thread, args=(asyncio.get_running_loop(), stop_event, stalls), daemon=True)
+    monitor.start()
+    started = time.perf_counter()
+    for _ in range(SAVES):
+        await save()
+        # সেভের মাঝে লুপকে একবার ছাড়ি, যাতে প্রতিটি ব্লকিং সেভ আলাদা স্টল হিসেবে মাপা হয়
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    stop_event.set()
+    await asyncio.to_thread(monitor.join)
+    stalls.sort()
+    p99 = stalls[int(len(stalls) * 0.99) - 1] if stalls else 0.0
+    print(f"{name:<8} saves={SAVES} total={elapsed:.2f}s max_stall={max(stalls, default=0) * 1000:.1f}ms p99_stall={p99 * 1000:.1f}ms stalled_total={sum(stalls):.2f}s")
+
+async def main():
+    if not MONGO_URI:
+        print("MONGO_URI is not set.")
+        return
+
+    payload = make_payload()
+
+    sync_collection = MongoClient(MONGO_URI)[DB_NAME][BENCH_COLLECTION]
+    async def sync_save():
+        sync_collection.update_one({"_id": "bench"}, {"$set": payload}, upsert=True)
+
+    async_collection = AsyncIOMotorClient(MONGO_URI)[DB_NAME][BENCH_COLLECTION]
+    async def async_save():
+        await async_collection.update_one({"_id": "bench"}, {"$set": payload}, upsert=True)
+
+    print(f"Payload: {USERS} users, 200 filters")
+    await run_case("pymongo", sync_save)
+    await run_case("motor", async_save)
+    await async_collection.drop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,11 +4,20 @@ import time
 import threading
 import re
 import hashlib
-from pyrogram import Client, filters
-from pyrogram.enums import ParseMode, ChatType
-from pyrogram.errors import MessageNotModified, FloodWait, UserNotParticipant
+import random
+import sys
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+import bson
+from pyrogram import Client, filters, idle
+from pyrogram.enums import ParseMode, ChatType, ChatMemberStatus
+from pyrogram.errors import MessageNotModified, FloodWait, UserNotParticipant, BadRequest, InternalServerError
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from pymongo import MongoClient
+from pymongo import UpdateOne, ReplaceOne, DeleteOne, ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from flask import Flask, render_template_string
 import requests
@@ -34,18 +43,23 @@ LOG_CHANNEL_ID = -1002623880704 # লগ মেসেজ পাঠানোর 
 MONGO_URI = os.environ.get("MONGO_URI")
 DB_NAME = "TA_HD_Anime"
 COLLECTION_NAME = "bot_data"
+FILTERS_COLLECTION_NAME = "filters" # প্রতিটি ফিল্টার একটি আলাদা ডকুমেন্ট
+USERS_COLLECTION_NAME = "users" # প্রতিটি ইউজার একটি আলাদা ডকুমেন্ট ({"_id": user_id})
+MEMBERS_COLLECTION_NAME = "members" # join চ্যানেলের membership index ({"_id": user_id, "channels": {channel_id: {...}}})
+AUTO_DELETE_COLLECTION_NAME = "auto_delete" # অপেক্ষমাণ auto-delete ({"_id": "<chat_id>:<due>", "chat_id", "message_ids", "due"})
+USER_UPSERT_BATCH_SIZE = 1000
+BROADCAST_BATCH_SIZE = 500
 
 # --- In-memory data structures ---
 # বটের বর্তমান অবস্থা সংরক্ষণ করার জন্য ডিকশনারি
-filters_dict = {}
-user_list = set()
 last_filter = None
-banned_users = set()
+banned_users = None # IdSet, নিচে তৈরি হয়
 restrict_status = False
 autodelete_time = 0
 user_states = {}
 start_message_data = {} # New: Stores the custom start message and buttons
 global_files = {'up': [], 'down': []} # New: Global files for all filters
+global_files_version = 0 # global_files বদলালেই বাড়ে, পুরনো delivery plan চেনার জন্য
 temp_files = {} # Transitory dictionary for storing forwarded messages
 saved_send_channels = [] # New: Stores channels added via /add_channel
 admin_powers = {'filter_message': True, 'auto_delete': True, 'admin_restrict': False} # New: Admin powers state
@@ -69,6 +83,10 @@ join_channels = [
 mongo_client = None
 db = None
 collection = None
+filters_collection = None
+users_collection = None
+members_collection = None
+auto_delete_collection = None
 
 # --- Flask Web Server ---
 # বটকে সচল রাখার জন্য একটি ছোট ওয়েব সার্ভার
@@ -130,59 +148,999 @@ def ping_service():
 
 # --- Database Functions ---
 # MongoDB-র সাথে সংযোগ স্থাপন
-def connect_to_mongodb():
-    global mongo_client, db, collection
+# Motor ব্যবহার করা হয় যাতে ডেটাবেস কলের সময় ইভেন্ট লুপ ব্লক না হয়
+# ক্লায়েন্ট তৈরি করতে নেটওয়ার্ক লাগে না, প্রথম কলের সময় সংযোগ হয়
+def open_mongodb():
+    global mongo_client, db, collection, filters_collection, users_collection, members_collection, auto_delete_collection
+    mongo_client = AsyncIOMotorClient(MONGO_URI)
+    db = mongo_client[DB_NAME]
+    collection = db[COLLECTION_NAME]
+    filters_collection = db[FILTERS_COLLECTION_NAME]
+    users_collection = db[USERS_COLLECTION_NAME]
+    members_collection = db[MEMBERS_COLLECTION_NAME]
+    auto_delete_collection = db[AUTO_DELETE_COLLECTION_NAME]
+
+async def prepare_mongodb():
+    await db.command("ping")
+    await filters_collection.create_index("keyword", unique=True)
+    await filters_collection.create_index("short_id")
+    await auto_delete_collection.create_index("due")
+
+async def connect_to_mongodb():
     try:
-        mongo_client = MongoClient(MONGO_URI)
-        db = mongo_client[DB_NAME]
-        collection = db[COLLECTION_NAME]
+        open_mongodb()
+        await prepare_mongodb()
         print("Successfully connected to MongoDB.")
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         exit(1)
 
-# ডেটাবেসে ডেটা সংরক্ষণ
+# --- Compact ID Set ---
+# ইউজার আইডির জন্য কম মেমোরির set: সাজানো array('q') (প্রতি আইডি ৮ বাইট) আর নতুন আইডির জন্য
+# একটি ছোট buffer set। buffer বড় হলে মূল array-এর সাথে merge করা হয়।
+# MongoDB-তে little-endian int64 এর packed binary হিসেবে সেভ হয়।
+class IdSet:
+    MIN_MERGE_THRESHOLD = 1024
+
+    def __init__(self, ids=()):
+        self.ids = array('q', sorted(set(ids)))
+        self.pending = set()
+
+    @classmethod
+    def from_bytes(cls, data):
+        id_set = cls()
+        id_set.ids.frombytes(data)
+        if sys.byteorder == "big":
+            id_set.ids.byteswap()
+        return id_set
+
+    # MongoDB থেকে পাওয়া মান (packed binary বা পুরনো list) থেকে তৈরি করা
+    @classmethod
+    def load(cls, value):
+        if isinstance(value, (bytes, bytearray)):
+            return cls.from_bytes(value)
+        return cls(value or [])
+
+    def to_bytes(self):
+        self.merge()
+        packed = array('q', self.ids)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed.tobytes()
+
+    def __contains__(self, user_id):
+        if user_id in self.pending:
+            return True
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending)
+
+    def __iter__(self):
+        self.merge()
+        return iter(self.ids)
+
+    def add(self, user_id):
+        if user_id in self:
+            return
+        self.pending.add(user_id)
+        if len(self.pending) >= max(self.MIN_MERGE_THRESHOLD, len(self.ids) // 32):
+            self.merge()
+
+    def discard(self, user_id):
+        self.pending.discard(user_id)
+        i = bisect_left(self.ids, user_id)
+        if i < len(self.ids) and self.ids[i] == user_id:
+            del self.ids[i]
+
+    def remove(self, user_id):
+        if user_id not in self:
+            raise KeyError(user_id)
+        self.discard(user_id)
+
+    # ইতিমধ্যে সাজানো এবং সবচেয়ে বড় আইডির চেয়ে বড় আইডিগুলো সরাসরি শেষে যোগ করা
+    def extend_sorted(self, user_ids):
+        if user_ids and (not self.ids or user_ids[0] > self.ids[-1]):
+            self.pending.difference_update(user_ids)
+            self.ids.extend(user_ids)
+        else:
+            for user_id in user_ids:
+                self.add(user_id)
+
+    def merge(self):
+        if self.pending:
+            self.ids = array('q', heapq.merge(self.ids, sorted(self.pending)))
+            self.pending = set()
+
+banned_users = IdSet()
+known_users = IdSet() # যেসব ইউজার users কালেকশনে আছে বলে জানা
+
+# --- Packed File ID List ---
+# ফিল্টারের file_ids সাধারণত বাড়তে থাকা, পরপর আসা চ্যানেল মেসেজ আইডি।
+# তাই প্রতিটি run-কে (আগের আইডি থেকে zigzag delta, run-এর বাড়তি দৈর্ঘ্য) দুটি varint হিসেবে রাখা হয়।
+# ১০০টি পরপর এপিসোড মাত্র কয়েক বাইট নেয়। ডিকোড শুধু iterate করার সময় (ডেলিভারির সময়) হয়।
+# বাইট ফরম্যাট: [version][varint count][varint last_id][tokens...]
+PACKED_IDS_VERSION = 1
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+class PackedIds:
+    def __init__(self, ids=()):
+        self.tokens = bytearray() # closed runs
+        self.count = 0
+        self.base = 0             # last ID covered by self.tokens
+        self.run_start = None     # open run that is not encoded yet
+        self.run_length = 0
+        self.extend(ids)
+
+    @classmethod
+    def from_bytes(cls, data):
+        packed = cls()
+        if not data:
+            return packed
+        pos = 1
+        packed.count, pos = decode_varint(data, pos)
+        packed.base, pos = decode_varint(data, pos)
+        packed.tokens = bytearray(data[pos:])
+        return packed
+
+    # MongoDB/journal থেকে পাওয়া মান (packed binary বা পুরনো list) থেকে তৈরি করা
+    @classmethod
+    def load(cls, value):
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (bytes, bytearray)):
+            return cls.from_bytes(value)
+        return cls(value or [])
+
+    def encode_run(self, out, base, start, length):
+        encode_varint(zigzag(start - base), out)
+        encode_varint(length, out)
+
+    def to_bytes(self):
+        out = bytearray([PACKED_IDS_VERSION])
+        last = self.base
+        tail = bytearray()
+        if self.run_start is not None:
+            self.encode_run(tail, self.base, self.run_start, self.run_length)
+            last = self.run_start + self.run_length
+        encode_varint(self.count, out)
+        encode_varint(last, out)
+        return bytes(out + self.tokens + tail)
+
+    def append(self, file_id):
+        if self.run_start is not None and file_id == self.run_start + self.run_length + 1:
+            self.run_length += 1
+        else:
+            if self.run_start is not None:
+                self.encode_run(self.tokens, self.base, self.run_start, self.run_length)
+                self.base = self.run_start + self.run_length
+            self.run_start = file_id
+            self.run_length = 0
+        self.count += 1
+
+    def extend(self, file_ids):
+        for file_id in file_ids:
+            self.append(file_id)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        data = self.tokens
+        pos = 0
+        current = 0
+        while pos < len(data):
+            delta, pos = decode_varint(data, pos)
+            length, pos = decode_varint(data, pos)
+            start = current + unzigzag(delta)
+            for file_id in range(start, start + length + 1):
+                yield file_id
+            current = start + length
+        if self.run_start is not None:
+            yield from range(self.run_start, self.run_start + self.run_length + 1)
+
+    # এডিট মেনুর জন্য (অ্যাডমিন পাথ), পুরো লিস্ট ডিকোড করে
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def to_list(self):
+        return list(self)
+
+# ফিল্টারের file_ids packed বাইটে রূপান্তর (MongoDB ও journal-এর জন্য)
+def pack_filter(filter_data):
+    packed = dict(filter_data)
+    if 'file_ids' in packed:
+        packed['file_ids'] = PackedIds.load(packed['file_ids']).to_bytes()
+    return packed
+
+def unpack_filter(packed):
+    filter_data = dict(packed)
+    if 'file_ids' in filter_data:
+        filter_data['file_ids'] = PackedIds.load(filter_data['file_ids'])
+    return filter_data
+
+# --- Write-ahead Journal ---
+# প্রতিটি পরিবর্তন MongoDB-তে যাওয়ার আগে একটি লোকাল ফাইলে (BSON রেকর্ড) লেখা হয়।
+# JOURNAL_FSYNC_INTERVAL সময়ের মধ্যে যত এন্ট্রি আসে সেগুলো একসাথে লিখে একবার fsync করা হয়।
+# প্রতিবার flush শুরু হলে নতুন একটি segment খোলা হয়; flush সফল হলে পুরনো segment মুছে ফেলা হয়।
+# প্রসেস হঠাৎ বন্ধ হলে পরের স্টার্টে বাকি segment-গুলো replay করে আবার সেভ করা হয়।
+JOURNAL_DIR = os.environ.get("JOURNAL_DIR", "journal")
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("JOURNAL_FSYNC_INTERVAL", "0.05"))
+
+class Journal:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segment_numbers()
+        self.segment = (existing[-1] + 1) if existing else 1
+        self.buffer = [] # (segment, encoded entry) not yet written to disk
+        self.lock = asyncio.Lock()
+        self.event = asyncio.Event()
+        self.task = None
+        self.stopping = False
+
+    def segment_numbers(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".wal") and name[:-4].isdigit():
+                numbers.append(int(name[:-4]))
+        return sorted(numbers)
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"{number:08d}.wal")
+
+    def append(self, entry):
+        self.buffer.append((self.segment, bson.encode(entry)))
+        self.event.set()
+
+    # এখন পর্যন্ত যা লেখা হয়েছে তা একটি segment-এ বন্ধ করে নতুন segment শুরু করা
+    def seal(self):
+        sealed = self.segment
+        self.segment += 1
+        return sealed
+
+    def write_pending(self, pending):
+        files = {}
+        try:
+            for segment, data in pending:
+                if segment not in files:
+                    files[segment] = open(self.segment_path(segment), "ab")
+                files[segment].write(data)
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files.values():
+                f.close()
+
+    async def write_buffer(self):
+        async with self.lock:
+            pending, self.buffer = self.buffer, []
+            if pending:
+                await asyncio.get_running_loop().run_in_executor(None, self.write_pending, pending)
+
+    # MongoDB-তে লেখা হয়ে গেছে এমন segment-গুলো মুছে ফেলা
+    async def discard(self, upto):
+        async with self.lock:
+            self.buffer = [(segment, data) for segment, data in self.buffer if segment > upto]
+            for number in self.segment_numbers():
+                if number <= upto:
+                    os.remove(self.segment_path(number))
+
+    # আগের রানে বাকি থেকে যাওয়া এন্ট্রিগুলো ক্রমানুসারে পড়া
+    def read_pending(self):
+        entries = []
+        for number in self.segment_numbers():
+            if number >= self.segment:
+                continue
+            with open(self.segment_path(number), "rb") as f:
+                try:
+                    for entry in bson.decode_file_iter(f):
+                        entries.append(entry)
+                except bson.errors.InvalidBSON:
+                    # A torn write at the tail of the last segment
+                    print(f"Journal segment {number} ends with a partial record, ignoring the rest.")
+        return entries
+
+    async def run(self):
+        while not self.stopping:
+            await self.event.wait()
+            if not self.stopping:
+                await asyncio.sleep(JOURNAL_FSYNC_INTERVAL)
+            self.event.clear()
+            try:
+                await self.write_buffer()
+            except Exception as e:
+                print(f"Error writing journal: {e}")
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.stopping = True
+        self.event.set()
+        if self.task:
+            await self.task
+        await self.write_buffer()
+
+journal = Journal(JOURNAL_DIR)
+
+# --- Dirty Tracking ---
+# কোন অংশ পরিবর্তিত হয়েছে তা মনে রাখা, যাতে সেভ করার সময় শুধু সেই অংশটুকুই লেখা হয়
+PERSISTED_FIELDS = ("last_filter", "banned_users", "restrict_status", "autodelete_time", "start_message_data", "global_files", "saved_send_channels", "admin_powers")
+dirty_fields = set()        # Top-level fields that need a $set
+dirty_filters = set()       # Filter documents that need to be replaced
+deleted_filters = set()     # Filter documents that need to be deleted
+renamed_filters = {}        # new keyword -> keyword of the stored document, in rename order
+dirty_user_states = set()   # User IDs whose state was set or cleared
+added_users = set()         # User IDs to upsert into the users collection
+dirty_memberships = {}      # (user_id, channel_id) -> (is_member, checked_at) for the members collection
+dirty_bans = {}             # user_id -> banned, unsaved ban/unban changes to the banned_users set
+
+# প্রতিটি mark_* ফাংশন আগে journal-এ এন্ট্রি লেখে, তারপর dirty চিহ্ন দেয়
+def mark_dirty(*fields):
+    global global_files_version
+    if "global_files" in fields:
+        global_files_version += 1
+    values = current_field_values(fields)
+    for field in fields:
+        journal.append({"op": "field", "name": field, "value": values[field]})
+    dirty_fields.update(fields)
+
+def mark_filter_dirty(keyword):
+    filter_data = filter_repo.peek(keyword)
+    journal.append({"op": "filter", "keyword": keyword, "data": pack_filter(filter_data) if filter_data is not None else None})
+    deleted_filters.discard(keyword)
+    dirty_filters.add(keyword)
+
+def mark_filter_deleted(keyword):
+    journal.append({"op": "filter", "keyword": keyword, "data": None})
+    # নাম বদলানো ডকুমেন্টটি মুছে গেলে তার পুরনো keyword-ও হিসাবে রাখা হয়; সেখানে কী থাকবে তা
+    # flush-এর সময় cache দেখে ঠিক হয় (নতুন করে তৈরি হয়ে থাকলে লেখা হয়, না হলে মোছা হয়)
+    original = renamed_filters.pop(keyword, None)
+    if original is not None:
+        deleted_filters.add(original)
+    dirty_filters.discard(keyword)
+    deleted_filters.add(keyword)
+
+# rename ডকুমেন্টের keyword বদলে দেয় (একটি update_one), তাই পুরো ফিল্টার আবার লেখা হয় না।
+# পরপর rename একটিতে মিলিয়ে রাখা হয় (a→b→c মানে ডকুমেন্ট a→c, a→b→a মানে কিছুই না)।
+def mark_filter_renamed(old_keyword, new_keyword):
+    filter_data = filter_repo.peek(new_keyword)
+    journal.append({"op": "rename", "old": old_keyword, "new": new_keyword, "data": pack_filter(filter_data)})
+    if old_keyword in dirty_filters:
+        dirty_filters.discard(old_keyword)
+        dirty_filters.add(new_keyword)
+    track_rename(old_keyword, new_keyword)
+
+def track_rename(old_keyword, new_keyword):
+    original = renamed_filters.pop(old_keyword, old_keyword)
+    deleted_filters.add(old_keyword)
+    if original == new_keyword:
+        return
+    if original in renamed_filters.values():
+        # ওই keyword-এর ডেটাবেস ডকুমেন্ট অন্য নামে সরে যাচ্ছে; এটি নতুন তৈরি ফিল্টার, তাই পুরোটা লেখা হয়
+        dirty_filters.add(new_keyword)
+        return
+    renamed_filters[new_keyword] = original
+
+def mark_user_state(user_id):
+    journal.append({"op": "user_state", "user_id": user_id, "state": user_states.get(user_id)})
+    dirty_user_states.add(user_id)
+
+def mark_user_added(user_id):
+    journal.append({"op": "user", "user_id": user_id})
+    added_users.add(user_id)
+
+# পুরো packed set journal-এ না লিখে শুধু এই ইউজারের পরিবর্তনটুকু লেখা হয়। পরিবর্তনটি dirty_bans-এ
+# আলাদা থাকে, যাতে MongoDB থেকে নতুন set লোড হলে তার উপর আবার প্রয়োগ করা যায়।
+def mark_banned(user_id, banned):
+    journal.append({"op": "ban", "user_id": user_id, "banned": banned})
+    dirty_bans[user_id] = banned
+
+def mark_membership(user_id, channel_id, is_member, checked_at=None):
+    checked_at = checked_at or time.time()
+    journal.append({"op": "member", "user_id": user_id, "channel_id": channel_id, "is_member": is_member, "at": checked_at})
+    dirty_memberships[(user_id, channel_id)] = (is_member, checked_at)
+
+# নতুন ডকুমেন্টের জন্য সব কিছু একবারে লেখা
+def mark_all_dirty():
+    mark_dirty(*PERSISTED_FIELDS)
+    dirty_user_states.update(user_states)
+
+# শুধু চাওয়া field-গুলোর মান; banned_users pack করা (পুরো array কপি) শুধু তখনই হয় যখন সেটি লাগে
+def current_field_values(fields=PERSISTED_FIELDS):
+    return {
+        field: banned_users.to_bytes() if field == "banned_users" else globals()[field]
+        for field in fields
+    }
+
+# ফিল্টার ডকুমেন্টের আকার: {"keyword": ..., "short_id": ..., "message_text": ..., "button_data": ..., "file_ids": ..., "type": ...}
+def filter_to_doc(keyword, filter_data):
+    doc = pack_filter(filter_data)
+    doc["keyword"] = keyword
+    doc["short_id"] = get_short_id(keyword)
+    return doc
+
+def doc_to_filter(doc):
+    doc = dict(doc)
+    doc.pop("_id", None)
+    doc.pop("short_id", None)
+    keyword = doc.pop("keyword")
+    return keyword, unpack_filter(doc)
+
+# ফিল্টারের ডকুমেন্ট অপারেশন, দুই ধাপে: আগে rename-এর ordered ধাপ, তারপর বাকি লেখা।
+# rename ধাপ: যে keyword-এ কোনো ডকুমেন্ট সরে আসবে সেখানকার পুরনো ডকুমেন্ট আগে মুছে ফেলা হয়, তারপর
+# প্রতিটি rename একটি update_one, এমন ক্রমে যে কোনো ডকুমেন্ট সরে যাওয়ার আগে তার জায়গায় অন্যটি আসে না।
+# keyword-এর unique index থাকায় একটি rename আংশিকভাবে হতে পারে না। চক্র (a↔b) হলে একটি rename
+# বাদ দিয়ে সেই ফিল্টারটি পুরো লেখা হয়।
+# বাকি ধাপ: স্পর্শ করা প্রতিটি keyword-এর জন্য cache-এ যা আছে তা-ই চূড়ান্ত; থাকলে ReplaceOne, না থাকলে
+# DeleteOne। যে ডকুমেন্ট rename হয়ে ঠিক জায়গায় চলে এসেছে আর বদলায়নি, সেটি আবার লেখা হয় না।
+def build_filter_ops():
+    moves = {keyword: original for keyword, original in renamed_filters.items() if filter_repo.peek(keyword) is not None}
+    sources = {original: keyword for keyword, original in moves.items()}
+    rewrite = set(dirty_filters)
+    ordered_moves = []
+    while moves:
+        ready = [keyword for keyword in moves if keyword not in sources]
+        if not ready:
+            ready = [next(iter(moves))]
+            rewrite.add(ready[0])
+            del sources[moves.pop(ready[0])]
+            continue
+        for keyword in ready:
+            original = moves.pop(keyword)
+            del sources[original]
+            ordered_moves.append((original, keyword))
+
+    moved_from = {original for original, keyword in ordered_moves}
+    moved_to = {keyword for original, keyword in ordered_moves}
+    rename_ops = [DeleteOne({"keyword": keyword}) for keyword in moved_to - moved_from]
+    rename_ops += [
+        UpdateOne({"keyword": original}, {"$set": {"keyword": keyword, "short_id": get_short_id(keyword)}})
+        for original, keyword in ordered_moves
+    ]
+
+    filter_ops = []
+    for keyword in dirty_filters | deleted_filters | set(renamed_filters) | set(renamed_filters.values()):
+        filter_data = filter_repo.peek(keyword)
+        if filter_data is None:
+            filter_ops.append(DeleteOne({"keyword": keyword}))
+        elif keyword not in moved_to or keyword in rewrite:
+            filter_ops.append(ReplaceOne({"keyword": keyword}, filter_to_doc(keyword, filter_data), upsert=True))
+    return rename_ops, filter_ops
+
+# নতুন ইউজারদের জন্য upsert (আগে থেকে থাকলে কিছুই বদলায় না)
+def user_upsert_op(user_id):
+    return UpdateOne({"_id": user_id}, {"$setOnInsert": {"joined_at": int(time.time())}}, upsert=True)
+
+async def upsert_users(user_ids):
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), USER_UPSERT_BATCH_SIZE):
+        batch = user_ids[i:i + USER_UPSERT_BATCH_SIZE]
+        await users_collection.bulk_write([user_upsert_op(uid) for uid in batch], ordered=False)
+
+# Dirty অংশগুলো থেকে bot_data ডকুমেন্টের MongoDB অপারেশন তৈরি করা
+def build_update():
+    set_doc = {}
+    unset_doc = {}
+
+    fields = dirty_fields | {"banned_users"} if dirty_bans else dirty_fields
+    values = current_field_values(fields)
+    for field in fields:
+        set_doc[field] = values[field]
+
+    for uid in dirty_user_states:
+        if uid in user_states:
+            set_doc[f"user_states.{uid}"] = user_states[uid]
+        else:
+            unset_doc[f"user_states.{uid}"] = ""
+
+    update = {}
+    if set_doc:
+        update["$set"] = set_doc
+    if unset_doc:
+        update["$unset"] = unset_doc
+    return update
+
+def build_member_ops():
+    return [
+        UpdateOne({"_id": user_id}, {"$set": {f"channels.{channel_id}": {"member": is_member, "at": checked_at}}}, upsert=True)
+        for (user_id, channel_id), (is_member, checked_at) in dirty_memberships.items()
+    ]
+
+def take_dirty():
+    snapshot = {
+        "fields": set(dirty_fields),
+        "bans": dict(dirty_bans),
+        "filters": set(dirty_filters),
+        "deleted_filters": set(deleted_filters),
+        "renamed_filters": dict(renamed_filters),
+        "user_states": set(dirty_user_states),
+        "users": set(added_users),
+        "memberships": dict(dirty_memberships)
+    }
+    for tracked in (dirty_fields, dirty_bans, dirty_filters, deleted_filters, renamed_filters, dirty_user_states, added_users, dirty_memberships):
+        tracked.clear()
+    return snapshot
+
+# লেখা ব্যর্থ হলে dirty চিহ্ন ফিরিয়ে দেওয়া (এর মধ্যে নতুন কোনো পরিবর্তন হলে সেটাই থাকবে)
+def restore_dirty(snapshot):
+    dirty_fields.update(snapshot["fields"])
+    for user_id, banned in snapshot["bans"].items():
+        dirty_bans.setdefault(user_id, banned)
+    # কোন ফিল্টারে কী লেখা হবে তা flush-এর সময় cache থেকে ঠিক হয়, তাই শুধু keyword-গুলো ফিরিয়ে দিলেই হয়
+    dirty_filters.update(snapshot["filters"])
+    deleted_filters.update(snapshot["deleted_filters"])
+    # ব্যর্থ লেখার rename আগে, তারপর এর মধ্যে হওয়া নতুনগুলো। কিছু rename হয়তো ইতিমধ্যে হয়ে গেছে,
+    # তাই আবার চেষ্টার সময় এগুলোর সব keyword cache থেকে পুরোটা লেখা (বা মোছা) হয়।
+    renames = [*snapshot["renamed_filters"].items(), *renamed_filters.items()]
+    renamed_filters.clear()
+    for keyword, original in renames:
+        dirty_filters.update((keyword, original))
+        track_rename(original, keyword)
+    dirty_user_states.update(snapshot["user_states"])
+    added_users.update(snapshot["users"])
+    for key, value in snapshot["memberships"].items():
+        dirty_memberships.setdefault(key, value)
+
+def has_dirty():
+    return bool(dirty_fields or dirty_bans or dirty_filters or deleted_filters or renamed_filters or dirty_user_states or added_users or dirty_memberships)
+
+save_lock = asyncio.Lock()
+flushing_filters = set() # লেখা চলাকালীন ফিল্টারগুলো cache থেকে বাদ পড়বে না
+data_version = 0 # শেষবার লেখা bot_data-র version, প্রতিটি flush-এ এক করে বাড়ে
+
+# ডেটাবেসে শুধু পরিবর্তিত ডেটা সংরক্ষণ (একটির পর একটি, যাতে পুরনো লেখা নতুনটিকে ওভাররাইট না করে)
+# bot_data সবার শেষে লেখা হয়, তাই version বাড়া মানে এর আগের সব লেখা পৌঁছে গেছে
+async def flush_data():
+    global data_version
+    async with save_lock:
+        update = build_update()
+        rename_ops, filter_ops = build_filter_ops()
+        member_ops = build_member_ops()
+        if not update and not rename_ops and not filter_ops and not member_ops and not added_users:
+            return
+        update["$inc"] = {"version": 1}
+        snapshot = take_dirty()
+        sealed_segment = journal.seal()
+        flushing_filters.update(snapshot["filters"] | snapshot["deleted_filters"], snapshot["renamed_filters"], snapshot["renamed_filters"].values())
+        try:
+            if snapshot["users"]:
+                await upsert_users(snapshot["users"])
+            if rename_ops:
+                await filters_collection.bulk_write(rename_ops, ordered=True)
+            if filter_ops:
+                await filters_collection.bulk_write(filter_ops, ordered=False)
+            if member_ops:
+                await members_collection.bulk_write(member_ops, ordered=False)
+            result = await collection.find_one_and_update(
+                {"_id": "bot_data"}, update, upsert=True,
+                projection={"version": 1}, return_document=ReturnDocument.AFTER
+            )
+        except Exception:
+            restore_dirty(snapshot)
+            raise
+        finally:
+            flushing_filters.clear()
+        data_version = result["version"]
+        await journal.discard(sealed_segment)
+        print(f"Data saved successfully to MongoDB ({len(rename_ops) + len(filter_ops) + len(member_ops) + 1} op(s), {len(snapshot['users'])} user(s), version {data_version}).")
+
+# --- Write-behind Persistence Queue ---
+# হ্যান্ডলারগুলো শুধু save_data() ডেকে পরিবর্তন চিহ্নিত করে, আর একটি মাত্র worker
+# PERSIST_DEBOUNCE সময়ের মধ্যে যত পরিবর্তন হয় সব একসাথে একটি লেখায় পাঠায়।
+# Worker একটাই এবং flush_data() lock দিয়ে চলে, তাই লেখাগুলো পরিবর্তনের ক্রমেই ডেটাবেসে পৌঁছায়:
+# কোনো flush শুরু হওয়ার আগে যা চিহ্নিত হয়েছে তা ওই flush বা তার আগের কোনোটিতে লেখা হবেই।
+PERSIST_DEBOUNCE = float(os.environ.get("PERSIST_DEBOUNCE", "0.25"))
+PERSIST_RETRY_DELAY = 5
+persist_event = asyncio.Event()
+persist_ready = asyncio.Event() # MongoDB-র সাথে মিলিয়ে নেওয়ার আগে কিছু লেখা হয় না
+persist_task = None
+persist_stopping = False
+
 def save_data():
-    global filters_dict, user_list, last_filter, banned_users, restrict_status, autodelete_time, user_states, start_message_data, global_files, saved_send_channels, admin_powers
-    str_user_states = {str(uid): state for uid, state in user_states.items()}
-    data = {
-        "filters_dict": filters_dict,
-        "user_list": list(user_list),
-        "last_filter": last_filter,
-        "banned_users": list(banned_users),
-        "restrict_status": restrict_status,
-        "autodelete_time": autodelete_time,
-        "user_states": str_user_states,
-        "start_message_data": start_message_data, # New: Save start message data
-        "global_files": global_files, # New: Save global files
-        "saved_send_channels": saved_send_channels, # New: Save send channels
-        "admin_powers": admin_powers # New: Save admin powers
+    persist_event.set()
+
+async def persistence_worker():
+    await persist_ready.wait()
+    while not persist_stopping:
+        await persist_event.wait()
+        if not persist_stopping:
+            await asyncio.sleep(PERSIST_DEBOUNCE)
+        persist_event.clear()
+        try:
+            await flush_data()
+        except Exception as e:
+            print(f"Error saving data to MongoDB: {e}")
+            persist_event.set()
+            if not persist_stopping:
+                await asyncio.sleep(PERSIST_RETRY_DELAY)
+
+def start_persistence():
+    global persist_task
+    persist_task = asyncio.create_task(persistence_worker())
+
+# বন্ধ হওয়ার সময় (SIGTERM সহ) বাকি সব পরিবর্তন লিখে ফেলা
+async def stop_persistence():
+    global persist_stopping
+    persist_stopping = True
+    persist_event.set()
+    if not persist_ready.is_set():
+        # MongoDB-তে পৌঁছানো যায়নি, পরিবর্তনগুলো journal-এ থেকে যায়
+        if persist_task:
+            persist_task.cancel()
+        return
+    if persist_task:
+        await persist_task
+    try:
+        await flush_data()
+    except Exception as e:
+        # MongoDB বন্ধ থাকলেও পরিবর্তনগুলো journal-এ থাকে, পরের চালুতে replay হবে
+        print(f"Error saving data to MongoDB on shutdown, changes kept in the journal: {e}")
+
+# --- Filter Repository ---
+# ফিল্টারগুলো বুটের সময় একসাথে লোড না করে প্রথমবার দরকার হলে ডেটাবেস থেকে আনা হয়,
+# এবং বেশি ব্যবহৃত ফিল্টারগুলো একটি সীমিত আকারের LRU cache-এ TTL সহ রাখা হয়।
+# যেসব ফিল্টার এখনো সেভ হয়নি (dirty) বা সেভ হচ্ছে, সেগুলো cache থেকে বাদ পড়ে না।
+FILTER_CACHE_SIZE = int(os.environ.get("FILTER_CACHE_SIZE", "500"))
+FILTER_CACHE_TTL = int(os.environ.get("FILTER_CACHE_TTL", "600"))
+
+class FilterRepository:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() # keyword -> (filter_data or None, expires_at)
+
+    def is_pinned(self, keyword):
+        return (keyword in dirty_filters or keyword in deleted_filters or keyword in flushing_filters
+                or keyword in renamed_filters or keyword in renamed_filters.values())
+
+    def remember(self, keyword, filter_data):
+        invalidate_delivery_plan(keyword)
+        self.entries[keyword] = (filter_data, time.monotonic() + self.ttl)
+        self.entries.move_to_end(keyword)
+        excess = len(self.entries) - self.max_size
+        if excess > 0:
+            victims = []
+            for cached_keyword in self.entries:
+                if len(victims) >= excess:
+                    break
+                if not self.is_pinned(cached_keyword):
+                    victims.append(cached_keyword)
+            for cached_keyword in victims:
+                del self.entries[cached_keyword]
+
+    # ডেটাবেসে না গিয়ে শুধু cache থেকে দেখা
+    def peek(self, keyword):
+        entry = self.entries.get(keyword)
+        return entry[0] if entry else None
+
+    # ফিল্টার না থাকলে None রিটার্ন করে (এটাও cache করা হয়)
+    async def get(self, keyword):
+        entry = self.entries.get(keyword)
+        if entry and (entry[1] > time.monotonic() or self.is_pinned(keyword)):
+            self.entries.move_to_end(keyword)
+            return entry[0]
+        doc = await filters_collection.find_one({"keyword": keyword})
+        if self.is_pinned(keyword) and keyword in self.entries:
+            # Written locally while the read was in flight, the local copy is newer
+            return self.entries[keyword][0]
+        filter_data = doc_to_filter(doc)[1] if doc else None
+        self.remember(keyword, filter_data)
+        return filter_data
+
+    def save(self, keyword, filter_data):
+        self.remember(keyword, filter_data)
+        mark_filter_dirty(keyword)
+
+    def delete(self, keyword):
+        self.remember(keyword, None)
+        mark_filter_deleted(keyword)
+
+    def rename(self, old_keyword, new_keyword, filter_data):
+        self.remember(new_keyword, filter_data)
+        self.remember(old_keyword, None)
+        mark_filter_renamed(old_keyword, new_keyword)
+
+    def invalidate(self, keyword):
+        if not self.is_pinned(keyword):
+            self.entries.pop(keyword, None)
+
+    def clear(self):
+        for keyword in [k for k in self.entries if not self.is_pinned(k)]:
+            del self.entries[keyword]
+
+    # Callback data-তে থাকা short_id থেকে ফিল্টারের নাম বের করা
+    # button_filter=None হলে যেকোনো ধরনের ফিল্টার মিলবে
+    async def find_by_short_id(self, short_id, button_filter=None):
+        def matches(filter_data):
+            if filter_data is None:
+                return False
+            return button_filter is None or (filter_data.get('type') == 'button_filter') == button_filter
+
+        for keyword in [*dirty_filters, *renamed_filters]:
+            if get_short_id(keyword) == short_id and matches(self.peek(keyword)):
+                return keyword
+        async for doc in filters_collection.find({"short_id": short_id}, {"keyword": 1}):
+            if matches(await self.get(doc["keyword"])):
+                return doc["keyword"]
+        return None
+
+filter_repo = FilterRepository(FILTER_CACHE_SIZE, FILTER_CACHE_TTL)
+
+# পুরনো bot_data.filters_dict থেকে ফিল্টারগুলো filters কালেকশনে সরানো (একবারই চলে)
+async def migrate_legacy_filters(legacy_filters):
+    ops = [ReplaceOne({"keyword": k}, filter_to_doc(k, v), upsert=True) for k, v in legacy_filters.items()]
+    if ops:
+        await filters_collection.bulk_write(ops, ordered=False)
+    await collection.update_one({"_id": "bot_data"}, {"$unset": {"filters_dict": ""}})
+    print(f"Migrated {len(ops)} filters to the '{FILTERS_COLLECTION_NAME}' collection.")
+
+# পুরনো bot_data.user_list থেকে ইউজারদের users কালেকশনে সরানো (একবারই চলে)
+async def migrate_legacy_users(legacy_users):
+    await upsert_users(legacy_users)
+    await collection.update_one({"_id": "bot_data"}, {"$unset": {"user_list": ""}})
+    print(f"Migrated {len(legacy_users)} users to the '{USERS_COLLECTION_NAME}' collection.")
+
+# short_id ছাড়া পুরনো ফিল্টার ডকুমেন্টে short_id যোগ করা (একবারই চলে)
+async def backfill_filter_short_ids():
+    ops = []
+    async for doc in filters_collection.find({"short_id": {"$exists": False}}, {"keyword": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"short_id": get_short_id(doc["keyword"])}}))
+    if ops:
+        await filters_collection.bulk_write(ops, ordered=False)
+        print(f"Added short IDs to {len(ops)} filters.")
+
+# users কালেকশন থেকে সব আইডি _id ক্রমে এনে known_users-এ রাখা (ব্যাকগ্রাউন্ডে চলে)
+known_users_loaded = False
+
+async def load_known_users():
+    global known_users_loaded
+    batch = []
+    try:
+        async for user_doc in users_collection.find({}, {"_id": 1}).sort("_id", 1).batch_size(BROADCAST_BATCH_SIZE):
+            batch.append(user_doc["_id"])
+            if len(batch) >= USER_UPSERT_BATCH_SIZE:
+                known_users.extend_sorted(batch)
+                batch = []
+        known_users.extend_sorted(batch)
+        known_users_loaded = True
+        print(f"Loaded {len(known_users)} known users.")
+    except Exception as e:
+        print(f"Error loading known users: {e}")
+
+async def run_migrations(data):
+    if data and "filters_dict" in data:
+        await migrate_legacy_filters(data["filters_dict"])
+    if data and "user_list" in data:
+        await migrate_legacy_users(data["user_list"])
+    await backfill_filter_short_ids()
+
+# bot_data ডকুমেন্ট (MongoDB বা snapshot থেকে) মেমোরিতে বসানো
+# keep_dirty=True হলে যেসব অংশ এখনো সেভ হয়নি সেগুলোর লোকাল মান রেখে দেওয়া হয়
+def apply_bot_data(data, keep_dirty=False):
+    global last_filter, banned_users, restrict_status, autodelete_time, user_states, start_message_data, global_files, saved_send_channels, admin_powers, data_version, global_files_version
+    skip = dirty_fields if keep_dirty else set()
+    loaded = {
+        "last_filter": data.get("last_filter", None),
+        "restrict_status": data.get("restrict_status", False),
+        "autodelete_time": data.get("autodelete_time", 0),
+        "start_message_data": data.get("start_message_data", {}), # New: Load start message data
+        "global_files": data.get("global_files", {'up': [], 'down': []}), # Load global files
+        "saved_send_channels": data.get("saved_send_channels", []), # Load saved send channels
+        "admin_powers": data.get("admin_powers", {'filter_message': True, 'auto_delete': True, 'admin_restrict': False}) # Load admin powers
     }
-    collection.update_one({"_id": "bot_data"}, {"$set": data}, upsert=True)
-    print("Data saved successfully to MongoDB.")
+    for field, value in loaded.items():
+        if field not in skip:
+            globals()[field] = value
+    global_files_version += 1
+    if "banned_users" not in skip:
+        # এখনো সেভ না হওয়া ban/unban-গুলো MongoDB-র set-এর উপর আবার প্রয়োগ করা
+        banned_users = IdSet.load(data.get("banned_users"))
+        for user_id, banned in dirty_bans.items():
+            if banned:
+                banned_users.add(user_id)
+            else:
+                banned_users.discard(user_id)
+    loaded_user_states = {int(uid): state for uid, state in data.get("user_states", {}).items()}
+    if keep_dirty:
+        for uid in dirty_user_states:
+            loaded_user_states.pop(uid, None)
+            if uid in user_states:
+                loaded_user_states[uid] = user_states[uid]
+    user_states = loaded_user_states
+    data_version = data.get("version", 0)
 
 # ডেটাবেস থেকে ডেটা লোড
-def load_data():
-    global filters_dict, user_list, last_filter, banned_users, restrict_status, autodelete_time, user_states, start_message_data, global_files, saved_send_channels, admin_powers
-    data = collection.find_one({"_id": "bot_data"})
+async def load_data():
+    data = await collection.find_one({"_id": "bot_data"})
+    await run_migrations(data)
     if data:
-        filters_dict = data.get("filters_dict", {})
-        user_list = set(data.get("user_list", []))
-        banned_users = set(data.get("banned_users", []))
-        last_filter = data.get("last_filter", None)
-        restrict_status = data.get("restrict_status", False)
-        autodelete_time = data.get("autodelete_time", 0)
-        loaded_user_states = data.get("user_states", {})
-        user_states = {int(uid): state for uid, state in loaded_user_states.items()}
-        start_message_data = data.get("start_message_data", {}) # New: Load start message data
-        global_files = data.get("global_files", {'up': [], 'down': []}) # Load global files
-        saved_send_channels = data.get("saved_send_channels", []) # Load saved send channels
-        admin_powers = data.get("admin_powers", {'filter_message': True, 'auto_delete': True, 'admin_restrict': False}) # Load admin powers
+        apply_bot_data(data)
         print("Data loaded successfully from MongoDB.")
     else:
         print("No data found in MongoDB. Starting with empty data.")
+        mark_all_dirty()
         save_data()
 
+# Journal-এ থাকা একটি পরিবর্তন আবার মেমোরিতে প্রয়োগ করা (mark_* আবার dirty চিহ্ন দেয়)
+def apply_journal_entry(entry):
+    global banned_users
+    op = entry.get("op")
+    if op == "field" and entry["name"] == "banned_users":
+        banned_users = IdSet.load(entry["value"])
+        mark_dirty("banned_users")
+    elif op == "field" and entry["name"] in PERSISTED_FIELDS:
+        globals()[entry["name"]] = entry["value"]
+        mark_dirty(entry["name"])
+    elif op == "filter":
+        if entry["data"] is None:
+            filter_repo.delete(entry["keyword"])
+        else:
+            filter_repo.save(entry["keyword"], unpack_filter(entry["data"]))
+    elif op == "rename":
+        # আগের রানে rename-টি হয়তো ডেটাবেসে পৌঁছে গিয়েছিল, তাই ফিল্টারটি পুরো লেখা হয়
+        filter_repo.rename(entry["old"], entry["new"], unpack_filter(entry["data"]))
+        mark_filter_dirty(entry["new"])
+    elif op == "user_state":
+        if entry["state"] is None:
+            user_states.pop(entry["user_id"], None)
+        else:
+            user_states[entry["user_id"]] = entry["state"]
+        mark_user_state(entry["user_id"])
+    elif op == "user":
+        mark_user_added(entry["user_id"])
+    elif op == "ban":
+        if entry["banned"]:
+            banned_users.add(entry["user_id"])
+        else:
+            banned_users.discard(entry["user_id"])
+        mark_banned(entry["user_id"], entry["banned"])
+    elif op == "member":
+        membership_cache.set(entry["user_id"], entry["channel_id"], entry["is_member"])
+        mark_membership(entry["user_id"], entry["channel_id"], entry["is_member"], entry["at"])
+
+# আগের রানে MongoDB-তে না পৌঁছানো পরিবর্তনগুলো replay করে সেভ করা
+async def replay_journal():
+    entries = journal.read_pending()
+    if not entries:
+        return
+    for entry in entries:
+        apply_journal_entry(entry)
+    save_data()
+    print(f"Replayed {len(entries)} journal entries.")
+
+# --- Local Snapshot ---
+# রিস্টার্টের পর MongoDB থেকে সব লোড হওয়ার অপেক্ষা না করে লোকাল ডিস্কের snapshot থেকে
+# সাথে সাথে চালু হওয়া যায়। snapshot-এ bot_data, known_users আর cache-এ থাকা ফিল্টারগুলো
+# BSON হিসেবে থাকে, সাথে শেষ flush-এর version। বুটের পর ব্যাকগ্রাউন্ডে MongoDB-র version
+# মিলিয়ে দেখা হয়; না মিললে MongoDB থেকে আবার লোড করা হয়।
+# শুধু সব পরিবর্তন সেভ হয়ে যাওয়ার পরেই snapshot লেখা হয়, তাই এটি ওই version-এর সাথে হুবহু মেলে।
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "snapshot.bson")
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", "300"))
+SNAPSHOT_FORMAT = 1
+snapshot_task = None
+
+def build_snapshot():
+    bot_data = current_field_values()
+    bot_data["user_states"] = {str(uid): state for uid, state in user_states.items()}
+    bot_data["version"] = data_version
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "bot_data": bot_data,
+        "filters": [filter_to_doc(k, v) for k, (v, _) in filter_repo.entries.items() if v is not None]
+    }
+    if known_users_loaded:
+        snapshot["known_users"] = known_users.to_bytes()
+    return snapshot
+
+def write_snapshot_file(payload):
+    tmp_path = SNAPSHOT_PATH + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, SNAPSHOT_PATH)
+
+async def save_snapshot():
+    async with save_lock:
+        if not persist_ready.is_set() or has_dirty():
+            return
+        payload = bson.encode(build_snapshot())
+    await asyncio.get_running_loop().run_in_executor(None, write_snapshot_file, payload)
+
+# snapshot না থাকলে বা পড়া না গেলে False রিটার্ন করে
+def load_snapshot():
+    global known_users, known_users_loaded
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f:
+            snapshot = bson.decode(f.read())
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot: {e}")
+        return False
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        return False
+    apply_bot_data(snapshot["bot_data"])
+    for doc in snapshot["filters"]:
+        filter_repo.remember(*doc_to_filter(doc))
+    if "known_users" in snapshot:
+        known_users = IdSet.from_bytes(snapshot["known_users"])
+        known_users_loaded = True
+    print(f"Loaded local snapshot (version {data_version}).")
+    return True
+
+# snapshot থেকে চালু হওয়ার পর MongoDB-র সাথে মিলিয়ে নেওয়া, তারপর লেখা শুরু হয়
+async def reconcile_with_mongodb():
+    snapshot_version = data_version
+    while True:
+        try:
+            await prepare_mongodb()
+            data = await collection.find_one({"_id": "bot_data"})
+            await run_migrations(data)
+            break
+        except Exception as e:
+            print(f"Error reconciling with MongoDB: {e}")
+            await asyncio.sleep(PERSIST_RETRY_DELAY)
+    if data is None:
+        print("No data found in MongoDB. Writing the local snapshot back.")
+        mark_all_dirty()
+    elif data.get("version", 0) != snapshot_version:
+        apply_bot_data(data, keep_dirty=True)
+        filter_repo.clear()
+        asyncio.create_task(load_known_users())
+        print(f"Local snapshot was stale (version {snapshot_version}, MongoDB {data_version}). Reloaded from MongoDB.")
+    else:
+        print("Local snapshot matches MongoDB.")
+    persist_ready.set()
+    save_data()
+
+async def snapshot_worker():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        try:
+            await save_snapshot()
+        except Exception as e:
+            print(f"Error writing local snapshot: {e}")
+
+def start_snapshots():
+    global snapshot_task
+    snapshot_task = asyncio.create_task(snapshot_worker())
+
+# বন্ধ হওয়ার সময় শেষ flush-এর পরে একবার snapshot লেখা
+async def stop_snapshots():
+    if snapshot_task:
+        snapshot_task.cancel()
+    try:
+        await save_snapshot()
+    except Exception as e:
+        print(f"Error writing local snapshot: {e}")
+
 # --- Pyrogram Client ---
 app = Client(
     "ta_file_share_bot",
@@ -191,6 +1149,59 @@ app = Client(
     bot_token=BOT_TOKEN
 )
 
+# --- Bot Identity ---
+# শেয়ার লিংকের জন্য বটের username চালুর পর একটি ব্যাকগ্রাউন্ড task get_me() দিয়ে আনে (ব্যর্থ হলে
+# backoff সহ আবার চেষ্টা করে) এবং BOT_IDENTITY_REFRESH সেকেন্ড পরপর হালনাগাদ করে।
+# username জানা হয়ে গেলে অনুরোধের পথে কোনো get_me() নেই; তার আগে কোনো অনুরোধ এলে share_link()
+# নিজেই একবার resolve করে নেয়, তাই লিংকে কখনো "None" বসে না।
+BOT_IDENTITY_REFRESH = int(os.environ.get("BOT_IDENTITY_REFRESH", "3600"))
+bot_username = None
+bot_identity_lock = asyncio.Lock()
+bot_identity_task = None
+
+async def refresh_bot_identity():
+    global bot_username
+    bot_username = (await app.get_me()).username
+
+# username এখনো জানা না থাকলে একবার resolve করা; একসাথে আসা অনুরোধগুলো একটিই get_me() ভাগ করে
+async def ensure_bot_identity():
+    if bot_username is None:
+        async with bot_identity_lock:
+            if bot_username is None:
+                await refresh_bot_identity()
+
+async def bot_identity_worker():
+    attempt = 0
+    while bot_username is None:
+        try:
+            await ensure_bot_identity()
+        except Exception as e:
+            attempt += 1
+            delay = backoff_delay(attempt)
+            print(f"Error resolving bot identity (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+    while True:
+        await asyncio.sleep(BOT_IDENTITY_REFRESH)
+        try:
+            await refresh_bot_identity()
+        except Exception as e:
+            print(f"Error refreshing bot identity: {e}")
+
+def start_bot_identity():
+    global bot_identity_task
+    bot_identity_task = asyncio.create_task(bot_identity_worker())
+
+def stop_bot_identity():
+    if bot_identity_task:
+        bot_identity_task.cancel()
+
+# বটের deep link (keyword না দিলে শুধু বটের লিংক)
+async def share_link(keyword=None):
+    await ensure_bot_identity()
+    if keyword:
+        return f"https://t.me/{bot_username}?start={keyword}"
+    return f"https://t.me/{bot_username}"
+
 # --- Helper Functions (Pyrogram) ---
 # Admin Power Keyboard Helper
 def get_admin_power_keyboard():
@@ -210,25 +1221,733 @@ def get_short_id(keyword):
     return hashlib.sha256(keyword.encode('utf-8')).hexdigest()[:8]
 
 # ব্যবহারকারী চ্যানেলের সদস্য কিনা তা পরীক্ষা করা
-async def is_user_member(client, user_id):
+# --- Membership Cache ---
+# প্রতিটি /start-এ প্রতিটি join চ্যানেলের জন্য get_chat_member না ডেকে (user, channel) অনুযায়ী
+# ফলাফল cache করা হয়। মেম্বার হলে বেশি সময় (MEMBER_CACHE_POSITIVE_TTL), না হলে অল্প সময়
+# (MEMBER_CACHE_NEGATIVE_TTL) মনে রাখা হয়, যাতে জয়েন করার পরপরই "Try Again" কাজ করে।
+MEMBER_CACHE_SIZE = int(os.environ.get("MEMBER_CACHE_SIZE", "50000"))
+MEMBER_CACHE_POSITIVE_TTL = int(os.environ.get("MEMBER_CACHE_POSITIVE_TTL", "3600"))
+MEMBER_CACHE_NEGATIVE_TTL = int(os.environ.get("MEMBER_CACHE_NEGATIVE_TTL", "15"))
+
+class MembershipCache:
+    def __init__(self, max_size, positive_ttl, negative_ttl):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict() # (user_id, channel_id) -> (is_member, expires_at)
+
+    def get(self, user_id, channel_id):
+        key = (user_id, channel_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, user_id, channel_id, is_member):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self.entries[(user_id, channel_id)] = (is_member, time.monotonic() + ttl)
+        self.entries.move_to_end((user_id, channel_id))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+membership_cache = MembershipCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_POSITIVE_TTL, MEMBER_CACHE_NEGATIVE_TTL)
+
+# --- Membership Index ---
+# বট join চ্যানেলগুলোর অ্যাডমিন, তাই জয়েন/লিভ/কিকের chat_member আপডেট পায়। সেগুলো থেকে
+# members কালেকশনে প্রতিটি ইউজারের প্রতিটি চ্যানেলের অবস্থা রাখা হয় (dirty tracking দিয়েই সেভ হয়)।
+# /start-এ cache-এ না থাকলে আগে এই index দেখা হয়; index-এ না থাকলে বা খুব পুরনো হলে তবেই
+# get_chat_member ডাকা হয়, আর সেই ফলাফলও index-এ লেখা হয়।
+# index থেকে শুধু "মেম্বার" অবস্থা নেওয়া হয়: জয়েনের আপডেট হারিয়ে গেলে (যেমন রিস্টার্টের সময়)
+# "মেম্বার নয়" এন্ট্রি বিশ্বাস করলে ইউজার দিনের পর দিন আটকে থাকত, তাই সেগুলো সবসময় আবার দেখা হয়।
+MEMBER_INDEX_MAX_AGE = int(os.environ.get("MEMBER_INDEX_MAX_AGE", str(7 * 24 * 3600)))
+MEMBER_STATUSES = (ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER, ChatMemberStatus.RESTRICTED)
+
+# ইউজারের index ডকুমেন্ট একবারে এনে যেসব চ্যানেলে তাজা "মেম্বার" অবস্থা আছে সেগুলো cache-এ বসানো
+async def load_membership_index(user_id):
     try:
-        for channel in join_channels:
-            await client.get_chat_member(channel['id'], user_id)
-        return True
-    except UserNotParticipant:
-        return False
+        doc = await members_collection.find_one({"_id": user_id})
     except Exception as e:
-        print(f"Error checking membership: {e}")
-        return False
+        print(f"Error reading membership index for {user_id}: {e}")
+        return
+    indexed = (doc or {}).get("channels", {})
+    now = time.time()
+    for channel in join_channels:
+        # এখনো সেভ না হওয়া পরিবর্তন ডেটাবেসের চেয়ে নতুন
+        entry = dirty_memberships.get((user_id, channel['id']))
+        if entry is None and str(channel['id']) in indexed:
+            entry = (indexed[str(channel['id'])]["member"], indexed[str(channel['id'])]["at"])
+        if entry and entry[0] and now - entry[1] < MEMBER_INDEX_MAX_AGE and membership_cache.get(user_id, channel['id']) is None:
+            membership_cache.set(user_id, channel['id'], True)
+
+# অন্য কোনো ভুল হলে (UserNotParticipant ছাড়া) exception বাইরে যায় এবং cache করা হয় না
+# recheck=True হলে cache-এ থাকা "মেম্বার নয়" ফলাফল বাদ দিয়ে আবার দেখা হয়
+async def is_channel_member(client, channel_id, user_id, recheck=False):
+    is_member = membership_cache.get(user_id, channel_id)
+    if is_member is None or (recheck and not is_member):
+        try:
+            await client.get_chat_member(channel_id, user_id)
+            is_member = True
+        except UserNotParticipant:
+            is_member = False
+        membership_cache.set(user_id, channel_id, is_member)
+        mark_membership(user_id, channel_id, is_member)
+        save_data()
+    return is_member
+
+# সব join চ্যানেল একসাথে (asyncio.gather) একবারেই দেখা, MEMBERSHIP_CHECK_TIMEOUT সেকেন্ডের মধ্যে।
+# যেসব চ্যানেলে ইউজার মেম্বার নয় বা জানা যায়নি, সেগুলোর তালিকা রিটার্ন করে (খালি হলে gate পার)।
+MEMBERSHIP_CHECK_TIMEOUT = 5
+
+async def get_missing_channels(client, user_id, recheck=False):
+    if any(membership_cache.get(user_id, channel['id']) is None for channel in join_channels):
+        await load_membership_index(user_id)
+
+    async def check(channel):
+        try:
+            return await is_channel_member(client, channel['id'], user_id, recheck)
+        except Exception as e:
+            print(f"Error checking membership in {channel['id']} for {user_id}: {e}")
+            return None
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(check(channel) for channel in join_channels)), MEMBERSHIP_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Membership check for {user_id} timed out.")
+        # সময়ের মধ্যে যেগুলোর উত্তর এসেছে সেগুলো cache-এ আছে
+        results = [membership_cache.get(user_id, channel['id']) for channel in join_channels]
+    return [channel for channel, is_member in zip(join_channels, results) if is_member is not True]
+
+# --- Outbound Rate Limiting ---
+# সব পাঠানো/ডিলিট কল একটি কেন্দ্রীয় token bucket দিয়ে যায়: পুরো বটের জন্য একটি global bucket
+# (প্রতি সেকেন্ডে ~৩০টি) আর প্রতিটি চ্যাটের জন্য আলাদা bucket (গ্রুপ/চ্যানেলে সেকেন্ডে ~১টি)।
+# আগে চ্যাটের bucket, তারপর global bucket থেকে token নেওয়া হয়, যাতে একটি ধীর চ্যাটের জন্য
+# অপেক্ষা করার সময় global token আটকে না থাকে।
+RATE_LIMIT_GLOBAL = float(os.environ.get("RATE_LIMIT_GLOBAL", "30"))
+RATE_LIMIT_PRIVATE_CHAT = float(os.environ.get("RATE_LIMIT_PRIVATE_CHAT", "1"))
+RATE_LIMIT_PRIVATE_BURST = int(os.environ.get("RATE_LIMIT_PRIVATE_BURST", "5"))
+RATE_LIMIT_GROUP_CHAT = float(os.environ.get("RATE_LIMIT_GROUP_CHAT", "1"))
+RATE_LIMIT_GROUP_BURST = int(os.environ.get("RATE_LIMIT_GROUP_BURST", "1"))
+RATE_LIMIT_MAX_CHATS = 10000 # এর বেশি চ্যাট bucket হলে অলস bucket-গুলো সরিয়ে ফেলা হয়
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock() # অপেক্ষমাণ কলগুলো আসার ক্রমে token পায়
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1):
+        async with self.lock:
+            self.refill()
+            while self.tokens < cost:
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= cost
+
+    # এখনই acquire করলে কত সেকেন্ড অপেক্ষা করতে হবে (token নেওয়া হয় না)
+    def delay(self, cost=1):
+        self.refill()
+        if self.lock.locked():
+            return max(cost - self.tokens, cost) / self.rate
+        return max(cost - self.tokens, 0) / self.rate
+
+    def is_idle(self):
+        self.refill()
+        return self.tokens >= self.capacity and not self.lock.locked()
+
+class RateLimiter:
+    def __init__(self):
+        self.global_bucket = TokenBucket(RATE_LIMIT_GLOBAL, RATE_LIMIT_GLOBAL)
+        self.chat_buckets = {}
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= RATE_LIMIT_MAX_CHATS:
+                for idle_chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle()]:
+                    del self.chat_buckets[idle_chat_id]
+            # পজিটিভ আইডি মানে প্রাইভেট চ্যাট, নেগেটিভ মানে গ্রুপ বা চ্যানেল
+            if chat_id > 0:
+                bucket = TokenBucket(RATE_LIMIT_PRIVATE_CHAT, RATE_LIMIT_PRIVATE_BURST)
+            else:
+                bucket = TokenBucket(RATE_LIMIT_GROUP_CHAT, RATE_LIMIT_GROUP_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id):
+        await self.chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def chat_delay(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        return bucket.delay() if bucket else 0
+
+rate_limiter = RateLimiter()
+
+# --- Retry Policy ---
+# প্রতিটি পাঠানো কল সর্বোচ্চ SEND_MAX_ATTEMPTS বার চেষ্টা করা হয়। FloodWait হলে Telegram যত সেকেন্ড
+# বলে (e.value) ঠিক তত অপেক্ষা, আর সার্ভার/নেটওয়ার্ক সমস্যায় jitter সহ exponential backoff।
+# 400/403 ধরনের স্থায়ী ভুলে (যেমন মেসেজ নেই, ইউজার বট ব্লক করেছে) আবার চেষ্টা করা হয় না।
+SEND_MAX_ATTEMPTS = int(os.environ.get("SEND_MAX_ATTEMPTS", "5"))
+SEND_BACKOFF_BASE = 1.0
+SEND_BACKOFF_MAX = 30.0
+SEND_MAX_FLOOD_WAIT = int(os.environ.get("SEND_MAX_FLOOD_WAIT", "300")) # এর বেশি অপেক্ষা করতে বললে হাল ছেড়ে দেওয়া হয়
+TRANSIENT_ERRORS = (InternalServerError, asyncio.TimeoutError, TimeoutError, ConnectionError, OSError)
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2 ** attempt))
+
+# func(*args, **kwargs) চালানো, প্রতিবার আগে chat_id-এর rate limit token নিয়ে।
+# defer_flood_wait=True দিলে FloodWait-এ এখানে না ঘুমিয়ে exception-টি caller-কে দেওয়া হয়।
+async def call_with_retry(chat_id, func, *args, defer_flood_wait=False, **kwargs):
+    for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+        await rate_limiter.acquire(chat_id)
+        try:
+            return await func(*args, **kwargs)
+        except FloodWait as e:
+            if defer_flood_wait or attempt == SEND_MAX_ATTEMPTS or e.value > SEND_MAX_FLOOD_WAIT:
+                raise
+            await asyncio.sleep(e.value)
+        except TRANSIENT_ERRORS as e:
+            if attempt == SEND_MAX_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"Transient error sending to {chat_id} (attempt {attempt}/{SEND_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+# --- Log Channel Sink ---
+# লগ মেসেজগুলো সাথে সাথে পাঠানো হয় না: log_event() শুধু queue-তে রাখে, আর একটি background task
+# প্রতি LOG_FLUSH_INTERVAL সেকেন্ডে জমা হওয়া লগগুলো Telegram-এর ৪০৯৬ অক্ষরের সীমার মধ্যে যতগুলো ধরে
+# একটি মেসেজে জোড়া লাগিয়ে পাঠায়। ইউজারের অনুরোধের পথে কোনো লগ পাঠানোর অপেক্ষা নেই।
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "3"))
+LOG_MESSAGE_LIMIT = 4096
+LOG_QUEUE_MAX = 10000 # এর বেশি জমে গেলে সবচেয়ে পুরনো লগ বাদ পড়ে
+LOG_SEPARATOR = "\n\n"
+log_queue = deque(maxlen=LOG_QUEUE_MAX)
+log_wakeup = asyncio.Event()
+log_task = None
+
+def log_event(text):
+    if len(text) > LOG_MESSAGE_LIMIT:
+        text = text[:LOG_MESSAGE_LIMIT - 1] + "…"
+    log_queue.append(text)
+    log_wakeup.set()
+
+# queue-এর শুরু থেকে যতগুলো লগ একটি মেসেজে ধরে
+def pack_log_events():
+    parts = []
+    size = 0
+    while log_queue:
+        extra = len(log_queue[0]) + (len(LOG_SEPARATOR) if parts else 0)
+        if parts and size + extra > LOG_MESSAGE_LIMIT:
+            break
+        parts.append(log_queue.popleft())
+        size += extra
+    return LOG_SEPARATOR.join(parts)
+
+async def flush_log_events():
+    while log_queue:
+        text = pack_log_events()
+        try:
+            await call_with_retry(LOG_CHANNEL_ID, app.send_message, LOG_CHANNEL_ID, text, parse_mode=ParseMode.MARKDOWN)
+        except Exception as e:
+            print(f"Failed to send log message: {e}")
+
+async def log_sink_worker():
+    while True:
+        await log_wakeup.wait()
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        log_wakeup.clear()
+        await flush_log_events()
+
+def start_log_sink():
+    global log_task
+    log_task = asyncio.create_task(log_sink_worker())
+
+# বন্ধ হওয়ার আগে বাকি লগগুলো পাঠিয়ে দেওয়া
+async def stop_log_sink():
+    if log_task:
+        log_task.cancel()
+    await flush_log_events()
+
+# --- Persistent Auto-delete ---
+# auto-delete-এর অপেক্ষমাণ কাজগুলো মেমোরির sleeping task-এ না রেখে auto_delete কালেকশনে
+# due সময় (epoch সেকেন্ড) সহ রাখা হয়, তাই রিস্টার্ট বা redeploy হলেও হারায় না।
+# একটি মাত্র loop পরের due সময় পর্যন্ত ঘুমায়, সময় হলে সেই ব্যাচ ডিলিট করে। বট বন্ধ থাকার সময়
+# যেগুলোর সময় পেরিয়ে গেছে, চালু হওয়ার পর প্রথমেই সেগুলো ডিলিট হয়।
+# কাজগুলো (চ্যাট, due সেকেন্ড) অনুযায়ী একটি ডকুমেন্টে জমা হয়, আর ডিলিটের সময় একই চ্যাটের সব
+# আইডি একসাথে করে প্রতি কলে সর্বোচ্চ ১০০টি করে delete_messages করা হয়।
+AUTO_DELETE_BATCH_SIZE = 100 # একবারে কতগুলো ডকুমেন্ট আনা হয়
+DELETE_CHUNK_SIZE = 100 # delete_messages প্রতি কলে সর্বোচ্চ ১০০টি আইডি নেয়
+AUTO_DELETE_MAX_SLEEP = 60 # নতুন job-এর খবর না পেলেও এত সেকেন্ড পরপর ডেটাবেস দেখা হয়
+auto_delete_wakeup = asyncio.Event()
+auto_delete_task = None
+
+# MongoDB-তে লেখা না গেলে কাজগুলো মেমোরিতে রাখার জন্য: due সেকেন্ডের heap, আর প্রতিটি
+# সেকেন্ডে চ্যাট অনুযায়ী array('q')-তে আইডি (প্রতি আইডি ৮ বাইট, কোনো task বা closure নেই)
+class DeletionBuckets:
+    def __init__(self):
+        self.heap = []      # due seconds
+        self.buckets = {}   # due second -> {chat_id: array('q')}
+
+    def add(self, chat_id, message_ids, due):
+        due = math.ceil(due)
+        bucket = self.buckets.get(due)
+        if bucket is None:
+            bucket = self.buckets[due] = {}
+            heapq.heappush(self.heap, due)
+        bucket.setdefault(chat_id, array('q')).extend(message_ids)
+
+    def next_due(self):
+        return self.heap[0] if self.heap else None
+
+    # সময় হয়ে যাওয়া সব bucket চ্যাট অনুযায়ী একসাথে করে তুলে নেওয়া
+    def pop_due(self, now, into):
+        while self.heap and self.heap[0] <= now:
+            for chat_id, message_ids in self.buckets.pop(heapq.heappop(self.heap)).items():
+                into.setdefault(chat_id, array('q')).extend(message_ids)
+
+pending_deletions = DeletionBuckets()
+
+async def delete_due_messages(chat_id, message_ids):
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), DELETE_CHUNK_SIZE):
+        chunk = message_ids[start:start + DELETE_CHUNK_SIZE]
+        try:
+            await call_with_retry(chat_id, app.delete_messages, chat_id, chunk)
+        except Exception as e:
+            print(f"Error deleting {len(chunk)} messages in chat {chat_id}: {e}")
+    print(f"Deleted {len(message_ids)} messages in chat {chat_id}.")
 
-# নির্দিষ্ট সময় পর মেসেজ ডিলিট করা
-async def delete_messages_later(chat_id, message_ids, delay_seconds):
-    await asyncio.sleep(delay_seconds)
+async def schedule_deletion(chat_id, message_ids, delay_seconds):
+    if not message_ids:
+        return
+    due = math.ceil(time.time() + delay_seconds)
     try:
-        await app.delete_messages(chat_id, message_ids)
-        print(f"Successfully deleted messages {message_ids} in chat {chat_id}.")
+        await auto_delete_collection.update_one(
+            {"_id": f"{chat_id}:{due}"},
+            {"$push": {"message_ids": {"$each": list(message_ids)}}, "$setOnInsert": {"chat_id": chat_id, "due": due}},
+            upsert=True
+        )
     except Exception as e:
-        print(f"Error deleting messages {message_ids} in chat {chat_id}: {e}")
+        print(f"Error saving auto-delete job, keeping it in memory: {e}")
+        pending_deletions.add(chat_id, message_ids, due)
+    auto_delete_wakeup.set()
+
+async def auto_delete_worker():
+    while True:
+        auto_delete_wakeup.clear()
+        now = time.time()
+        due_chats = {}
+        pending_deletions.pop_due(now, due_chats)
+        due_doc_ids = []
+        next_due = pending_deletions.next_due()
+        try:
+            async for doc in auto_delete_collection.find({"due": {"$lte": now}}).sort("due", 1).limit(AUTO_DELETE_BATCH_SIZE):
+                due_chats.setdefault(doc["chat_id"], array('q')).extend(doc["message_ids"])
+                due_doc_ids.append(doc["_id"])
+            if len(due_doc_ids) < AUTO_DELETE_BATCH_SIZE:
+                next_doc = await auto_delete_collection.find_one({"due": {"$gt": now}}, {"due": 1}, sort=[("due", 1)])
+                if next_doc and (next_due is None or next_doc["due"] < next_due):
+                    next_due = next_doc["due"]
+            else:
+                next_due = now
+            timeout = AUTO_DELETE_MAX_SLEEP
+        except Exception as e:
+            print(f"Error loading auto-delete jobs: {e}")
+            timeout = PERSIST_RETRY_DELAY
+
+        for chat_id, message_ids in due_chats.items():
+            await delete_due_messages(chat_id, message_ids)
+        if due_doc_ids:
+            try:
+                await auto_delete_collection.delete_many({"_id": {"$in": due_doc_ids}})
+            except Exception as e:
+                print(f"Error removing finished auto-delete jobs: {e}")
+
+        if next_due is not None:
+            timeout = min(timeout, max(next_due - time.time(), 0))
+        try:
+            await asyncio.wait_for(auto_delete_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def start_auto_delete():
+    global auto_delete_task
+    auto_delete_task = asyncio.create_task(auto_delete_worker())
+
+def stop_auto_delete():
+    if auto_delete_task:
+        auto_delete_task.cancel()
+
+# --- File Delivery ---
+# ফাইলগুলো একটি একটি করে copy না করে forward_messages দিয়ে প্রতি কলে সর্বোচ্চ ১০০টি করে পাঠানো হয়।
+# drop_author=True দিলে copy-র মতোই "Forwarded from" দেখায় না, আর ক্রমও একই থাকে।
+# কোনো chunk ব্যর্থ হলে শুধু সেই chunk-এর আইডিগুলো একটি একটি করে copy করা হয়।
+# অ্যালবাম (media group) কখনো দুই chunk-এ ভাগ হয় না, তাই একসাথে forward হয়ে অ্যালবাম হিসেবেই পৌঁছায়;
+# fallback-এর সময় পুরো অ্যালবাম copy_media_group দিয়ে একবারে পাঠানো হয়।
+# প্রতিটি ডেলিভারি একটি DeliveryJob, যেটি কোন পর্যন্ত পাঠানো হয়েছে তা মনে রাখে। মাঝপথে থেমে গেলে
+# (লম্বা FloodWait বা বারবার নেটওয়ার্ক সমস্যা) job-টি রেখে দেওয়া হয় এবং পরের বার ঠিক সেখান থেকে শুরু হয়।
+DELIVERY_CHUNK_SIZE = 100
+MEDIA_GROUP_MAX_SIZE = 10
+DELIVERY_RESUME_TTL = int(os.environ.get("DELIVERY_RESUME_TTL", "3600"))
+
+# FloodWait-এ এরা ঘুমায় না; delivery_step সেটি scheduler-কে জানিয়ে দেয়
+async def copy_file(chat_id, file_id, protect_content):
+    return await call_with_retry(chat_id, app.copy_message, chat_id, CHANNEL_ID, file_id, protect_content=protect_content, defer_flood_wait=True)
+
+async def forward_file_chunk(chat_id, chunk, protect_content):
+    return await call_with_retry(chat_id, app.forward_messages, chat_id, CHANNEL_ID, chunk, drop_author=True, protect_content=protect_content, defer_flood_wait=True)
+
+async def copy_album(chat_id, album, protect_content):
+    return await call_with_retry(chat_id, app.copy_media_group, chat_id, CHANNEL_ID, album[0], protect_content=protect_content, defer_flood_wait=True)
+
+# file_ids-কে একক ফাইল আর পূর্ণ অ্যালবামে ভাগ করা। চ্যানেলের অ্যালবামের সব মেসেজ
+# একই ক্রমে পাশাপাশি থাকলে তবেই সেটি অ্যালবাম, কারণ copy_media_group পুরো অ্যালবামই পাঠায়।
+def split_delivery_units(file_ids, media_groups):
+    album_of = {}
+    for album in (media_groups or {}).values():
+        if 1 < len(album) <= MEDIA_GROUP_MAX_SIZE:
+            album_of[album[0]] = album
+    file_ids = list(file_ids)
+    units = []
+    i = 0
+    while i < len(file_ids):
+        album = album_of.get(file_ids[i])
+        if album and file_ids[i:i + len(album)] == album:
+            units.append(album)
+            i += len(album)
+        else:
+            units.append([file_ids[i]])
+            i += 1
+    return units
+
+# --- Delivery Plans ---
+# প্রতিবার /start-এ global up + ফিল্টারের ফাইল + global down জোড়া লাগিয়ে unit/chunk বানানোর বদলে
+# প্রতিটি ফিল্টারের জন্য একবার একটি plan তৈরি করে রাখা হয়: পূর্ণ (up/down সহ) আর শুধু ফিল্টারের
+# ফাইল (filter message বন্ধ থাকলে অ্যাডমিনের জন্য), দুটোই অপরিবর্তনীয় tuple হিসেবে।
+# ফিল্টার সেভ/মুছে ফেলা/নতুন করে লোড হলে তার plan বাদ পড়ে, আর global files বদলালে version বাড়ে।
+
+class DeliveryVariant:
+    def __init__(self, file_ids, media_groups):
+        self.file_ids = tuple(file_ids)
+        self.units = tuple(tuple(unit) for unit in split_delivery_units(self.file_ids, media_groups))
+        # chunk_ends[i]: i নম্বর unit থেকে শুরু হওয়া chunk কোথায় শেষ হয় (অ্যালবাম না ভেঙে)
+        chunk_ends = []
+        end = 0
+        size = 0
+        for start in range(len(self.units)):
+            if end < start:
+                end = start
+                size = 0
+            while end < len(self.units) and (end == start or size + len(self.units[end]) <= DELIVERY_CHUNK_SIZE):
+                size += len(self.units[end])
+                end += 1
+            chunk_ends.append(end)
+            size -= len(self.units[start])
+        self.chunk_ends = tuple(chunk_ends)
+
+class DeliveryPlan:
+    def __init__(self, filter_data):
+        self.global_version = global_files_version
+        media_groups = filter_data.get('media_groups')
+        self.bare = DeliveryVariant(filter_data['file_ids'], media_groups)
+        up = global_files.get('up') or []
+        down = global_files.get('down') or []
+        if up or down:
+            self.full = DeliveryVariant([*up, *filter_data['file_ids'], *down], media_groups)
+        else:
+            self.full = self.bare
+
+delivery_plans = OrderedDict() # keyword -> DeliveryPlan, LRU ক্রমে
+
+def get_delivery_plan(keyword, filter_data):
+    plan = delivery_plans.get(keyword)
+    if plan is None or plan.global_version != global_files_version:
+        plan = DeliveryPlan(filter_data)
+        delivery_plans[keyword] = plan
+        if len(delivery_plans) > FILTER_CACHE_SIZE:
+            delivery_plans.popitem(last=False)
+    delivery_plans.move_to_end(keyword)
+    return plan
+
+def invalidate_delivery_plan(keyword):
+    delivery_plans.pop(keyword, None)
+
+class DeliveryJob:
+    def __init__(self, chat_id, variant, protect_content):
+        self.chat_id = chat_id
+        self.file_ids = variant.file_ids
+        self.protect_content = protect_content
+        self.units = list(variant.units)
+        self.chunk_ends = variant.chunk_ends # অ্যালবাম ভাঙা হলে None
+        self.position = 0           # পরের যে unit পাঠাতে হবে
+        self.fallback_end = 0       # এই unit পর্যন্ত একটি একটি করে copy করা হবে
+        self.sent_message_ids = []  # পাঠানো মেসেজগুলোর আইডি, ক্রম অনুযায়ী
+        self.failed_ids = []        # যেসব ফাইল পাঠানো যায়নি (যেমন চ্যানেলে মেসেজটি নেই)
+        self.missing_count = 0      # forward-এর সময় Telegram যেগুলো বাদ দিয়েছে
+        self.flood_waits = 0        # বর্তমান অংশে পরপর কতবার FloodWait এসেছে
+
+    @property
+    def done(self):
+        return self.position >= len(self.units)
+
+    @property
+    def files_done(self):
+        return sum(len(unit) for unit in self.units[:self.position])
+
+    # অ্যালবাম না ভেঙে প্রতি chunk-এ সর্বোচ্চ DELIVERY_CHUNK_SIZE আইডি রাখা
+    def next_chunk(self):
+        if self.chunk_ends is not None:
+            return self.units[self.position:self.chunk_ends[self.position]]
+        units = []
+        size = 0
+        for unit in self.units[self.position:]:
+            if units and size + len(unit) > DELIVERY_CHUNK_SIZE:
+                break
+            units.append(unit)
+            size += len(unit)
+        return units
+
+# job-এর পরের অংশটুকু একটি API কলে পাঠানো (একটি forward chunk, বা fallback-এ একটি ফাইল/অ্যালবাম)।
+# কোনো একটি ফাইলের স্থায়ী ভুল (BadRequest) হলে সেটি failed_ids-এ রেখে এগিয়ে যায়; অন্য কোনো
+# ভুল হলে exception বাইরে যায় আর job.position থেমে যাওয়ার জায়গাটি ধরে রাখে।
+# worker-কে আটকে না রাখতে: চ্যাটের bucket খালি থাকলে বা FloodWait এলে কিছু না পাঠিয়ে কত সেকেন্ড
+# পরে আবার চেষ্টা করতে হবে তা ফেরত দেয় (0 মানে এখনই পরের ধাপ চালানো যায়)।
+async def delivery_step(job):
+    delay = rate_limiter.chat_delay(job.chat_id)
+    if delay > 0:
+        return delay
+    try:
+        await send_next_part(job)
+    except FloodWait as e:
+        job.flood_waits += 1
+        if job.flood_waits >= SEND_MAX_ATTEMPTS or e.value > SEND_MAX_FLOOD_WAIT:
+            raise
+        print(f"FloodWait of {e.value}s delivering to {job.chat_id}, parking the job.")
+        return e.value
+    job.flood_waits = 0
+    return 0
+
+async def send_next_part(job):
+    if job.position >= job.fallback_end:
+        units = job.next_chunk()
+        chunk = [file_id for unit in units for file_id in unit]
+        try:
+            sent = await forward_file_chunk(job.chat_id, chunk, job.protect_content)
+        except BadRequest as e:
+            print(f"Error forwarding {len(chunk)} messages to {job.chat_id}, copying one by one: {e}")
+            job.fallback_end = job.position + len(units)
+            return
+        if not isinstance(sent, list):
+            sent = [sent]
+        job.sent_message_ids.extend(msg.id for msg in sent)
+        if len(sent) < len(chunk):
+            # চ্যানেল থেকে মুছে যাওয়া মেসেজ Telegram বাদ দিয়ে দেয়, copy করলেও সেগুলো পাওয়া যেত না
+            job.missing_count += len(chunk) - len(sent)
+            print(f"{len(chunk) - len(sent)} message(s) no longer exist in the file channel.")
+        job.position += len(units)
+        return
+
+    unit = job.units[job.position]
+    if len(unit) > 1:
+        try:
+            sent = await copy_album(job.chat_id, unit, job.protect_content)
+            job.sent_message_ids.extend(msg.id for msg in sent)
+            job.position += 1
+        except BadRequest as e:
+            print(f"Error copying album {unit[0]} to {job.chat_id}: {e}")
+            # অ্যালবামটি আলাদা আলাদা ফাইলে ভেঙে আবার চেষ্টা করা
+            job.units[job.position:job.position + 1] = [(file_id,) for file_id in unit]
+            job.chunk_ends = None
+            job.fallback_end += len(unit) - 1
+        return
+    try:
+        sent_msg = await copy_file(job.chat_id, unit[0], job.protect_content)
+        job.sent_message_ids.append(sent_msg.id)
+    except BadRequest as e:
+        print(f"Error copying message {unit[0]} to {job.chat_id}: {e}")
+        job.failed_ids.append(unit[0])
+    job.position += 1
+
+# --- Delivery Scheduler ---
+# প্রতিটি ইউজারের ডেলিভারি আলাদা queue-তে থাকে, আর কয়েকটি worker পালা করে (round-robin)
+# প্রতিটি ইউজারের job থেকে একবারে একটি API কল (delivery_step) চালায়। ফলে ৩০০ ফাইলের একটি
+# বড় ফিল্টার পাঠানোর সময়েও অন্য ইউজারদের ছোট অনুরোধ পেছনে আটকে থাকে না।
+# একই ইউজারের job-গুলো ক্রমানুসারে চলে, আর সব কল rate limiter-এর global বাজেটের মধ্যেই থাকে।
+# কোনো ইউজারের চ্যাটের bucket খালি থাকলে বা FloodWait এলে worker সেখানে ঘুমায় না: সেই ইউজারকে
+# একটি not-before সময় সহ parked heap-এ রেখে worker পরের ইউজারের কাজে চলে যায়।
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "4"))
+DELIVERY_WAIT_SAMPLES = 1000 # wait-time metrics-এর জন্য শেষ কতগুলো মান রাখা হয়
+
+class DeliveryScheduler:
+    def __init__(self, workers):
+        self.workers = workers
+        self.queues = {}        # owner -> deque of [job, future, submitted_at, started]
+        self.ready = deque()    # যেসব owner-এর কাজ বাকি, পালার ক্রমে
+        self.parked = []        # heap of (not_before, sequence, owner)
+        self.sequence = 0
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.wait_times = deque(maxlen=DELIVERY_WAIT_SAMPLES)
+        self.completed = 0
+        self.interrupted = 0
+        self.deferrals = 0
+        self.deferred_seconds = 0.0
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    # job শেষ হলে (বা থেমে গেলে) future-টি সম্পন্ন হয়
+    def submit(self, owner, job):
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.get(owner)
+        if queue is None:
+            queue = self.queues[owner] = deque()
+            self.ready.append(owner)
+            self.wakeup.set()
+        queue.append([job, future, time.monotonic(), False])
+        return future
+
+    async def run(self, owner, job):
+        return await self.submit(owner, job)
+
+    def park(self, owner, delay):
+        self.deferrals += 1
+        self.deferred_seconds += delay
+        self.sequence += 1
+        heapq.heappush(self.parked, (time.monotonic() + delay, self.sequence, owner))
+        self.wakeup.set() # অপেক্ষমাণ worker-রা নতুন not-before অনুযায়ী timeout ঠিক করবে
+
+    # যাদের not-before সময় পেরিয়ে গেছে তাদের আবার পালায় ফিরিয়ে আনা
+    def release_parked(self):
+        now = time.monotonic()
+        while self.parked and self.parked[0][0] <= now:
+            self.ready.append(heapq.heappop(self.parked)[2])
+
+    async def worker(self):
+        while True:
+            self.release_parked()
+            while not self.ready:
+                self.wakeup.clear()
+                timeout = max(self.parked[0][0] - time.monotonic(), 0) if self.parked else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.release_parked()
+            owner = self.ready.popleft()
+            queue = self.queues[owner]
+            entry = queue[0]
+            job, future = entry[0], entry[1]
+            finished = True
+            delay = 0
+            if not future.done():
+                if not entry[3]:
+                    entry[3] = True
+                    self.wait_times.append(time.monotonic() - entry[2])
+                try:
+                    if not job.done:
+                        delay = await delivery_step(job)
+                    finished = job.done
+                    if finished:
+                        self.completed += 1
+                        future.set_result(job)
+                except Exception as e:
+                    self.interrupted += 1
+                    if not future.done():
+                        future.set_exception(e)
+            if finished:
+                queue.popleft()
+            if not queue:
+                del self.queues[owner]
+            elif delay > 0:
+                self.park(owner, delay)
+            else:
+                self.ready.append(owner)
+
+    def stats(self):
+        waits = sorted(self.wait_times)
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+        pending = [entry[0] for queue in self.queues.values() for entry in queue]
+        return {
+            "users": len(self.queues),
+            "jobs": len(pending),
+            "files": sum(len(job.file_ids) - job.files_done for job in pending),
+            "completed": self.completed,
+            "interrupted": self.interrupted,
+            "parked": len(self.parked),
+            "deferrals": self.deferrals,
+            "deferred_seconds": self.deferred_seconds,
+            "wait_p50": percentile(0.5),
+            "wait_p95": percentile(0.95),
+            "wait_max": waits[-1] if waits else 0.0
+        }
+
+delivery_scheduler = DeliveryScheduler(DELIVERY_WORKERS)
+
+# --- Duplicate Request Coalescing ---
+# একই ইউজার একই লিংক বারবার চাপলে প্রতিবার নতুন করে সব ফাইল পাঠানো হয় না: একটি ডেলিভারি
+# চলার সময় একই (user, keyword)-এর নতুন অনুরোধ বাতিল হয়, আর শেষ হওয়ার পর DELIVERY_COOLDOWN
+# সেকেন্ডের মধ্যে আবার চাইলেও পাঠানো হয় না (0 দিলে cooldown বন্ধ)।
+DELIVERY_COOLDOWN = int(os.environ.get("DELIVERY_COOLDOWN", "30"))
+active_deliveries = set()          # (user_id, keyword)
+recent_deliveries = OrderedDict()  # (user_id, keyword) -> finished_at, শেষ হওয়ার ক্রমে
+
+def delivery_block_reason(user_id, keyword):
+    key = (user_id, keyword)
+    if key in active_deliveries:
+        return "active"
+    now = time.monotonic()
+    while recent_deliveries and next(iter(recent_deliveries.values())) + DELIVERY_COOLDOWN <= now:
+        recent_deliveries.popitem(last=False)
+    if key in recent_deliveries:
+        return "cooldown"
+    return None
+
+def finish_delivery(user_id, keyword, completed):
+    key = (user_id, keyword)
+    active_deliveries.discard(key)
+    if completed and DELIVERY_COOLDOWN > 0:
+        recent_deliveries.pop(key, None)
+        recent_deliveries[key] = time.monotonic()
+
+# /send একসাথে কতগুলো চ্যানেলে পাঠাবে, আর স্ট্যাটাস মেসেজ কত সেকেন্ড পরপর আপডেট হবে
+SEND_FANOUT_CONCURRENCY = int(os.environ.get("SEND_FANOUT_CONCURRENCY", "3"))
+SEND_PROGRESS_INTERVAL = 3
+
+# থেমে যাওয়া ডেলিভারিগুলো (chat_id, keyword) অনুযায়ী কিছুক্ষণ রেখে দেওয়া হয়
+interrupted_deliveries = {} # (chat_id, keyword) -> (DeliveryJob, expires_at)
+
+# একই চ্যাটে একই ফাইলগুলোর থেমে যাওয়া ডেলিভারি থাকলে সেটি, না হলে নতুন job
+def resume_or_create_delivery(chat_id, keyword, variant, protect_content):
+    entry = interrupted_deliveries.pop((chat_id, keyword), None)
+    if entry:
+        job, expires_at = entry
+        if expires_at > time.monotonic() and job.file_ids == variant.file_ids and job.protect_content == protect_content:
+            return job
+    return DeliveryJob(chat_id, variant, protect_content)
+
+def keep_for_resume(job, keyword):
+    now = time.monotonic()
+    for key in [k for k, (_, expires_at) in interrupted_deliveries.items() if expires_at <= now]:
+        del interrupted_deliveries[key]
+    interrupted_deliveries[(job.chat_id, keyword)] = (job, now + DELIVERY_RESUME_TTL)
 
 # পেজিনেশন সহ বোতাম তৈরি করা (পরিবর্তিত)
 def create_paged_buttons(keyword, button_list, page, page_size=10):
@@ -430,13 +2149,58 @@ def parse_swap_pairs(text, max_index):
             raise ValueError("Invalid pair format. Use `i-j` or `iu-j`.")
     return pairs, moves
 
+# ফিল্টারের ফাইলগুলো ইউজারকে পাঠানো; সব ফাইল পাঠানো শেষ হলে True রিটার্ন করে
+async def send_filter_files(message, user_id, deep_link_keyword, filter_data):
+    is_admin = (user_id == ADMIN_ID)
+    show_filter_msg = not (is_admin and not admin_powers.get('filter_message', True))
+    apply_auto_del = autodelete_time > 0 and not (is_admin and not admin_powers.get('auto_delete', True))
+    apply_restrict = restrict_status and not (is_admin and not admin_powers.get('admin_restrict', False))
+
+    if show_filter_msg:
+        if apply_auto_del:
+            minutes = autodelete_time // 60
+            hours = autodelete_time // 3600
+            if hours > 0:
+                delete_time_str = f"{hours} hour{'s' if hours > 1 else ''}"
+            else:
+                delete_time_str = f"{minutes} minute{'s' if minutes > 1 else ''}"
+            await message.reply_text(f"✅ **Files found!** Sending now. Please note, these files will be automatically deleted in **{delete_time_str}**.", parse_mode=ParseMode.MARKDOWN)
+        else:
+            await message.reply_text(f"✅ **Files found!** Sending now...")
+
+    # Global up files + filter files + global down files (filter message বন্ধ থাকলে শুধু ফিল্টারের ফাইল)
+    plan = get_delivery_plan(deep_link_keyword, filter_data)
+    variant = plan.full if show_filter_msg else plan.bare
+    job = resume_or_create_delivery(message.chat.id, deep_link_keyword, variant, apply_restrict)
+    already_sent = len(job.sent_message_ids)
+    completed = False
+    try:
+        await delivery_scheduler.run(user_id, job)
+        completed = True
+    except Exception as e:
+        print(f"Delivery of '{deep_link_keyword}' to {message.chat.id} stopped at file {job.files_done + 1}: {e}")
+        keep_for_resume(job, deep_link_keyword)
+        try:
+            await message.reply_text("⚠️ **Sending was interrupted.** Open the link again to continue from where it stopped.", parse_mode=ParseMode.MARKDOWN)
+        except Exception:
+            pass
+    else:
+        if show_filter_msg:
+            await message.reply_text("🎉 **All files sent!**")
+
+    if apply_auto_del:
+        await schedule_deletion(message.chat.id, job.sent_message_ids[already_sent:], autodelete_time)
+    return completed
+
 # --- Message Handlers (Pyrogram) ---
 # /start কমান্ড হ্যান্ডলার (পরিবর্তিত)
 @app.on_message(filters.command("start") & filters.private)
 async def start_cmd(client, message):
     user_id = message.from_user.id
-    user_list.add(user_id)
-    save_data()
+    if user_id not in known_users:
+        known_users.add(user_id)
+        mark_user_added(user_id)
+        save_data()
     
     if user_id in banned_users:
         return await message.reply_text("❌ **You are banned from using this bot.**")
@@ -449,10 +2213,7 @@ async def start_cmd(client, message):
     )
     if user.username:
         log_message += f"\n🔗 Username: @{user.username}"
-    try:
-        await client.send_message(LOG_CHANNEL_ID, log_message, parse_mode=ParseMode.MARKDOWN)
-    except Exception as e:
-        print(f"Failed to send log message: {e}")
+    log_event(log_message)
     
     args = message.text.split(maxsplit=1)
     deep_link_keyword = args[1].lower() if len(args) > 1 else None
@@ -462,26 +2223,17 @@ async def start_cmd(client, message):
             f"🔗 **New Deep Link Open!**\n\n"
             f"🆔 User ID: `{user.id}`\n"
             f"👤 User Name: `{user.first_name} {user.last_name or ''}`\n"
-            f"🔗 Link: `https://t.me/{(await client.get_me()).username}?start={deep_link_keyword}`"
+            f"🔗 Link: `{await share_link(deep_link_keyword)}`"
         )
         if user.username:
             log_link_message += f"\nUsername: @{user.username}"
-        try:
-            await client.send_message(LOG_CHANNEL_ID, log_link_message, parse_mode=ParseMode.MARKDOWN)
-        except Exception as e:
-            print(f"Failed to log deep link message: {e}")
+        log_event(log_link_message)
 
-    if not await is_user_member(client, user_id):
-        buttons = []
-        for channel in join_channels:
-            try:
-                await client.get_chat_member(channel['id'], user_id)
-            except UserNotParticipant:
-                buttons.append([InlineKeyboardButton(f"✅ Join {channel['name']}", url=channel['link'])])
+    missing_channels = await get_missing_channels(client, user_id)
+    if missing_channels:
+        buttons = [[InlineKeyboardButton(f"✅ Join {channel['name']}", url=channel['link'])] for channel in missing_channels]
         
-        bot_username = (await client.get_me()).username
-        try_again_url = f"https://t.me/{bot_username}?start={deep_link_keyword}" if deep_link_keyword else f"https://t.me/{bot_username}"
-        buttons.append([InlineKeyboardButton("🔄 Try Again", url=try_again_url)])
+        buttons.append([InlineKeyboardButton("🔄 Try Again", url=await share_link(deep_link_keyword))])
         keyboard = InlineKeyboardMarkup(buttons)
         
         return await message.reply_text(
@@ -490,62 +2242,25 @@ async def start_cmd(client, message):
             parse_mode=ParseMode.MARKDOWN
         )
 
-    if deep_link_keyword and deep_link_keyword in filters_dict:
-        filter_data = filters_dict[deep_link_keyword]
-        
+    filter_data = await filter_repo.get(deep_link_keyword) if deep_link_keyword else None
+    if filter_data is not None:
         if 'button_data' in filter_data and filter_data['button_data']:
             reply_text = filter_data.get('message_text', "Select an option:")
             reply_markup = create_paged_buttons(deep_link_keyword, filter_data['button_data'], 1)
             await message.reply_text(reply_text, reply_markup=reply_markup)
         
         elif 'file_ids' in filter_data and filter_data['file_ids']:
-            is_admin = (user_id == ADMIN_ID)
-            show_filter_msg = not (is_admin and not admin_powers.get('filter_message', True))
-            apply_auto_del = autodelete_time > 0 and not (is_admin and not admin_powers.get('auto_delete', True))
-            apply_restrict = restrict_status and not (is_admin and not admin_powers.get('admin_restrict', False))
-
-            if show_filter_msg:
-                if apply_auto_del:
-                    minutes = autodelete_time // 60
-                    hours = autodelete_time // 3600
-                    if hours > 0:
-                        delete_time_str = f"{hours} hour{'s' if hours > 1 else ''}"
-                    else:
-                        delete_time_str = f"{minutes} minute{'s' if minutes > 1 else ''}"
-                    await message.reply_text(f"✅ **Files found!** Sending now. Please note, these files will be automatically deleted in **{delete_time_str}**.", parse_mode=ParseMode.MARKDOWN)
-                else:
-                    await message.reply_text(f"✅ **Files found!** Sending now...")
-            
-            # Combine global up files, filter files, and global down files
-            file_ids_to_send = []
-            if show_filter_msg:
-                if 'up' in global_files and global_files['up']:
-                    file_ids_to_send.extend(global_files['up'])
-            
-            file_ids_to_send.extend(filter_data['file_ids'])
-            
-            if show_filter_msg:
-                if 'down' in global_files and global_files['down']:
-                    file_ids_to_send.extend(global_files['down'])
-
-            sent_message_ids = []
-            for file_id in file_ids_to_send:
-                try:
-                    sent_msg = await app.copy_message(message.chat.id, CHANNEL_ID, file_id, protect_content=apply_restrict)
-                    sent_message_ids.append(sent_msg.id)
-                    await asyncio.sleep(0)
-                except FloodWait as e:
-                    await asyncio.sleep(e.value)
-                    sent_msg = await app.copy_message(message.chat.id, CHANNEL_ID, file_id, protect_content=apply_restrict)
-                    sent_message_ids.append(sent_msg.id)
-                except Exception as e:
-                    print(f"Error copying message {file_id}: {e}")
-            
-            if show_filter_msg:
-                await message.reply_text("🎉 **All files sent!**")
-                
-            if apply_auto_del:
-                asyncio.create_task(delete_messages_later(message.chat.id, sent_message_ids, autodelete_time))
+            block_reason = delivery_block_reason(user_id, deep_link_keyword)
+            if block_reason == "active":
+                return await message.reply_text("⏳ **Your files are already being sent.** Please wait for them to arrive.", parse_mode=ParseMode.MARKDOWN)
+            if block_reason == "cooldown":
+                return await message.reply_text("✅ **These files were just sent to you.** Please check the messages above.", parse_mode=ParseMode.MARKDOWN)
+            active_deliveries.add((user_id, deep_link_keyword))
+            completed = False
+            try:
+                completed = await send_filter_files(message, user_id, deep_link_keyword, filter_data)
+            finally:
+                finish_delivery(user_id, deep_link_keyword, completed)
         else:
             await message.reply_text("❌ **No files or buttons found for this keyword.**")
         
@@ -571,7 +2286,8 @@ async def start_cmd(client, message):
             "**/auto_delete <time>** - Set auto-delete time for files (e.g., 30m, 1h, off).\n"
             "**/channel_id** - Get the ID of a channel or user.\n"
             "**/add_channel** - Manage multiple channels to forward files to.\n"
-            "**/send <filter_name>** - Send all files of a filter to saved channels."
+            "**/send <filter_name>** - Send all files of a filter to saved channels.\n"
+            "**/queue_stats** - Show delivery queue depth and wait times."
         )
         await message.reply_text(admin_commands, parse_mode=ParseMode.MARKDOWN)
     else:
@@ -614,13 +2330,15 @@ async def send_cmd(client, message):
         return await message.reply_text("📌 **Usage:** `/send <filter_name>`")
     
     keyword = args[1].lower().strip()
-    if keyword not in filters_dict or not filters_dict[keyword].get('file_ids'):
+    filter_data = await filter_repo.get(keyword)
+    if filter_data is None or not filter_data.get('file_ids'):
         return await message.reply_text("❌ **Filter not found or it has no files.**")
     
     if not saved_send_channels:
         return await message.reply_text("❌ **No channels have been added yet. Use /add_channel first.**")
         
     user_states[message.from_user.id] = {"command": "sending_filter", "keyword": keyword}
+    mark_user_state(message.from_user.id)
     save_data()
     
     keyboard = []
@@ -638,6 +2356,7 @@ async def send_cmd(client, message):
 async def button_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "button_awaiting_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **ফিল্টারের জন্য একটি নাম দিন:**")
 
@@ -646,6 +2365,7 @@ async def button_cmd(client, message):
 async def edit_filter_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "edit_file_awaiting_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **Please provide the name of the file filter you want to edit:**")
 
@@ -665,6 +2385,7 @@ async def global_files_cmd(client, message):
 async def edit_button_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "edit_awaiting_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **Please provide the name of the button filter you want to edit.**")
 
@@ -673,6 +2394,7 @@ async def edit_button_cmd(client, message):
 async def change_filter_name_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "change_name_awaiting_old_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **Please provide the current name of the filter you want to change.**")
 
@@ -681,6 +2403,7 @@ async def change_filter_name_cmd(client, message):
 async def merge_filter_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "merge_awaiting_target_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **অনুগ্রহ করে নতুন মার্জ করা ফিল্টারের জন্য একটি নাম দিন:**")
 
@@ -689,6 +2412,7 @@ async def merge_filter_cmd(client, message):
 async def filter_data_cmd(client, message):
     user_id = message.from_user.id
     user_states[user_id] = {"command": "filter_data_awaiting_name"}
+    mark_user_state(user_id)
     save_data()
     await message.reply_text("➡️ **অনুগ্রহ করে যে বোতাম ফিল্টারের ডেটা চান তার নাম দিন:**")
 
@@ -714,9 +2438,23 @@ async def channel_id_cmd(client, message):
     ])
     await message.reply_text("➡️ **Select an option to get the ID:**", reply_markup=keyboard)
 
+# /queue_stats কমান্ড হ্যান্ডলার: ডেলিভারি queue-এর অবস্থা
+@app.on_message(filters.command("queue_stats") & filters.private & filters.user(ADMIN_ID))
+async def queue_stats_cmd(client, message):
+    stats = delivery_scheduler.stats()
+    await message.reply_text(
+        f"📊 **Delivery Queue**\n\n"
+        f"👥 Users waiting: {stats['users']}\n"
+        f"📦 Jobs queued: {stats['jobs']} ({stats['files']} files left)\n"
+        f"✅ Completed: {stats['completed']}\n"
+        f"⚠️ Interrupted: {stats['interrupted']}\n"
+        f"⏸️ Parked (rate limit/FloodWait): {stats['parked']} now, {stats['deferrals']} total, {stats['deferred_seconds']:.0f}s deferred\n"
+        f"⏱️ Wait before first send: p50 {stats['wait_p50']:.2f}s, p95 {stats['wait_p95']:.2f}s, max {stats['wait_max']:.2f}s",
+        parse_mode=ParseMode.MARKDOWN
+    )
 
 # সাধারণ মেসেজ এবং মিডিয়া হ্যান্ডলার (নতুন লজিক সহ)
-@app.on_message(filters.private & filters.user(ADMIN_ID) & ~filters.command(["start", "button", "broadcast", "delete", "restrict", "ban", "unban", "auto_delete", "channel_id", "editbutton", "change_filter_name", "merge_filter", "filter_data", "start_message", "global_files", "edit_filter", "add_channel", "send", "admin_power"]))
+@app.on_message(filters.private & filters.user(ADMIN_ID) & ~filters.command(["start", "button", "broadcast", "delete", "restrict", "ban", "unban", "auto_delete", "channel_id", "editbutton", "change_filter_name", "merge_filter", "filter_data", "start_message", "global_files", "edit_filter", "add_channel", "send", "admin_power", "queue_stats"]))
 async def message_handler(client, message):
     user_id = message.from_user.id
     state = user_states.get(user_id)
@@ -732,10 +2470,11 @@ async def message_handler(client, message):
     
     if state["command"] == "button_awaiting_name":
         keyword = message.text.lower().strip()
-        if keyword in filters_dict:
+        if await filter_repo.get(keyword) is not None:
             return await message.reply_text("⚠️ **এই নামে একটি ফিল্টার ইতিমধ্যে আছে।** অনুগ্রহ করে অন্য একটি নাম দিন:")
 
         user_states[user_id] = {"command": "button_awaiting_buttons", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await message.reply_text("➡️ **বোতামের কোড দিন (যেমন: Button 01 = link1, Button 02 = link2, [Button Name]):**")
 
@@ -747,15 +2486,17 @@ async def message_handler(client, message):
         if button_data is None:
             return await message.reply_text("❌ **ভুল বোতাম ফরম্যাট বা অবৈধ লিংক।** অনুগ্রহ করে সঠিক URL দিন (http/https/t.me/www):")
 
-        filters_dict[keyword] = {
+        filter_repo.save(keyword, {
             'message_text': "Select a button from the list below:",
             'button_data': button_data,
-            'file_ids': [],
+            'file_ids': PackedIds(),
             'type': 'button_filter'
-        }
+        })
 
         try:
-            sent_msg = await app.send_message(
+            sent_msg = await call_with_retry(
+                CHANNEL_ID,
+                app.send_message,
                 CHANNEL_ID,
                 f"#{keyword}\n[button (বোতাম ফিল্টার)]"
             )
@@ -764,29 +2505,32 @@ async def message_handler(client, message):
             await message.reply_text(f"❌ **চ্যানেলে সেভ করতে সমস্যা হয়েছে:** {e}")
 
         await message.reply_text(
-            f"✅ **বোতাম ফিল্টার '{keyword}' সফলভাবে তৈরি হয়েছে।**\n🔗 শেয়ার লিংক: `https://t.me/{(await client.get_me()).username}?start={keyword}`",
+            f"✅ **বোতাম ফিল্টার '{keyword}' সফলভাবে তৈরি হয়েছে।**\n🔗 শেয়ার লিংক: `{await share_link(keyword)}`",
             parse_mode=ParseMode.MARKDOWN
         )
 
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
         
     elif state["command"] == "edit_awaiting_name":
         keyword = message.text.lower().strip()
-        if keyword not in filters_dict or filters_dict[keyword].get('type') != 'button_filter':
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None or filter_data.get('type') != 'button_filter':
             return await message.reply_text("❌ **Filter not found or it is not a button filter.** Please provide a valid button filter name:")
         
         user_states[user_id] = {"command": "edit_button_menu", "keyword": keyword, "page": 1}
+        mark_user_state(user_id)
         save_data()
         
-        filter_data = filters_dict[keyword]
         keyboard = create_paged_edit_buttons(keyword, filter_data['button_data'], 1)
         await message.reply_text("✅ **You are now editing the buttons for this filter.**\n\n**Select an option below:**", reply_markup=keyboard)
 
     elif state["command"] == "edit_add_buttons":
         # Handle adding new buttons
         keyword = state.get("keyword")
-        if not keyword or keyword not in filters_dict:
+        filter_data = await filter_repo.get(keyword) if keyword else None
+        if filter_data is None:
             return await message.reply_text("❌ **Filter not found.** Please start the process again with /editbutton.")
             
         button_text = message.text.strip()
@@ -795,36 +2539,37 @@ async def message_handler(client, message):
         if new_buttons is None:
             return await message.reply_text("❌ **ভুল বোতাম ফরম্যাট বা অবৈধ লিংক।** অনুগ্রহ করে সঠিক URL দিন:")
         
-        filters_dict[keyword]['button_data'].extend(new_buttons)
+        filter_data['button_data'].extend(new_buttons)
+        filter_repo.save(keyword, filter_data)
         save_data()
         
         # Reset state and show the updated menu
         user_states[user_id] = {"command": "edit_button_menu", "keyword": keyword, "page": 1}
+        mark_user_state(user_id)
         save_data()
-        
-        filter_data = filters_dict[keyword]
         keyboard = create_paged_edit_buttons(keyword, filter_data['button_data'], 1)
         await message.reply_text("✅ **Buttons have been added.**\n\n**Select an option below:**", reply_markup=keyboard)
         
     elif state["command"] == "edit_delete_buttons":
         # Handle deleting buttons by number
         keyword = state.get("keyword")
-        if not keyword or keyword not in filters_dict:
+        filter_data = await filter_repo.get(keyword) if keyword else None
+        if filter_data is None:
             return await message.reply_text("❌ **Filter not found.** Please start the process again with /editbutton.")
 
         input_text = message.text.strip()
         try:
-            delete_indices = parse_button_numbers(input_text, len(filters_dict[keyword]['button_data']))
-            filters_dict[keyword]['button_data'] = [
-                button for i, button in enumerate(filters_dict[keyword]['button_data']) 
+            delete_indices = parse_button_numbers(input_text, len(filter_data['button_data']))
+            filter_data['button_data'] = [
+                button for i, button in enumerate(filter_data['button_data']) 
                 if i + 1 not in delete_indices
             ]
+            filter_repo.save(keyword, filter_data)
             save_data()
 
             user_states[user_id] = {"command": "edit_button_menu", "keyword": keyword, "page": 1}
+            mark_user_state(user_id)
             save_data()
-            
-            filter_data = filters_dict[keyword]
             keyboard = create_paged_edit_buttons(keyword, filter_data['button_data'], 1)
             await message.reply_text("🗑️ **Buttons have been deleted.**\n\n**Select an option below:**", reply_markup=keyboard)
 
@@ -834,13 +2579,14 @@ async def message_handler(client, message):
     elif state["command"] == "edit_set_buttons":
         # Handle setting/rearranging buttons
         keyword = state.get("keyword")
-        if not keyword or keyword not in filters_dict:
+        filter_data = await filter_repo.get(keyword) if keyword else None
+        if filter_data is None:
             return await message.reply_text("❌ **Filter not found.** Please start the process again with /editbutton.")
             
         input_text = message.text.strip()
         try:
-            swap_pairs, move_pairs = parse_swap_pairs(input_text, len(filters_dict[keyword]['button_data']))
-            button_list = filters_dict[keyword]['button_data']
+            swap_pairs, move_pairs = parse_swap_pairs(input_text, len(filter_data['button_data']))
+            button_list = filter_data['button_data']
             
             # Perform swaps
             for i, j in swap_pairs:
@@ -852,12 +2598,12 @@ async def message_handler(client, message):
                 button_to_move = button_list.pop(i - 1)
                 button_list.insert(j - 1, button_to_move)
 
+            filter_repo.save(keyword, filter_data)
             save_data()
 
             user_states[user_id] = {"command": "edit_button_menu", "keyword": keyword, "page": 1}
+            mark_user_state(user_id)
             save_data()
-            
-            filter_data = filters_dict[keyword]
             keyboard = create_paged_edit_buttons(keyword, filter_data['button_data'], 1)
             await message.reply_text("🔄 **Buttons have been rearranged.**\n\n**Select an option below:**", reply_markup=keyboard)
 
@@ -866,18 +2612,22 @@ async def message_handler(client, message):
             
     elif state["command"] == "edit_file_awaiting_name":
         keyword = message.text.lower().strip()
-        if keyword not in filters_dict or filters_dict[keyword].get('type') == 'button_filter':
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None or filter_data.get('type') == 'button_filter':
             return await message.reply_text("❌ **Filter not found or it is a button filter.** Please provide a valid file filter name:")
         
         user_states[user_id] = {"command": "edit_file_menu", "keyword": keyword, "page": 1}
+        mark_user_state(user_id)
         save_data()
         
-        filter_data = filters_dict[keyword]
         keyboard = create_paged_file_edit_buttons(keyword, filter_data['file_ids'], 1)
         await message.reply_text("✅ **You are now editing the files for this filter.**\n\n**Select an option below:**", reply_markup=keyboard)
         
     elif state["command"] == "edit_file_awaiting_forwards":
         keyword = state["keyword"]
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None:
+            return await message.reply_text("❌ **Filter not found.** Please start the process again with /edit_filter.")
         if message.text and message.text.lower().startswith("[id]"):
             id_str = message.text[4:].strip()
             try:
@@ -885,32 +2635,34 @@ async def message_handler(client, message):
                 if not new_ids:
                     return await message.reply_text("❌ **কোনো সঠিক ID পাওয়া যায়নি।**")
                 
-                filters_dict[keyword].setdefault('file_ids', []).extend(new_ids)
+                filter_data.setdefault('file_ids', PackedIds()).extend(new_ids)
+                filter_repo.save(keyword, filter_data)
                 save_data()
                 
                 user_states[user_id] = {"command": "edit_file_menu", "keyword": keyword, "page": 1}
+                mark_user_state(user_id)
                 save_data()
-                filter_data = filters_dict[keyword]
                 keyboard = create_paged_file_edit_buttons(keyword, filter_data['file_ids'], 1)
                 await message.reply_text(f"✅ **{len(new_ids)} Files added using ID.**\n\n**Select an option below:**", reply_markup=keyboard)
             except ValueError:
                 await message.reply_text("❌ **Invalid ID format. Use [id] 123,456**")
         elif message.text and message.text.lower() == 'ok':
             if user_id in temp_files and temp_files[user_id]:
-                filters_dict[keyword].setdefault('file_ids', []).extend(temp_files[user_id])
+                filter_data.setdefault('file_ids', PackedIds()).extend(temp_files[user_id])
                 del temp_files[user_id]
+                filter_repo.save(keyword, filter_data)
                 save_data()
                 
                 user_states[user_id] = {"command": "edit_file_menu", "keyword": keyword, "page": 1}
+                mark_user_state(user_id)
                 save_data()
-                filter_data = filters_dict[keyword]
                 keyboard = create_paged_file_edit_buttons(keyword, filter_data['file_ids'], 1)
                 await message.reply_text("✅ **Files have been added.**\n\n**Select an option below:**", reply_markup=keyboard)
             else:
                 await message.reply_text("❌ **No files were forwarded.**")
         else:
             try:
-                new_msg = await message.copy(CHANNEL_ID)
+                new_msg = await call_with_retry(CHANNEL_ID, message.copy, CHANNEL_ID)
                 if user_id not in temp_files:
                     temp_files[user_id] = []
                 temp_files[user_id].append(new_msg.id)
@@ -920,13 +2672,17 @@ async def message_handler(client, message):
 
     elif state["command"] == "edit_file_delete":
         keyword = state.get("keyword")
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None:
+            return await message.reply_text("❌ **Filter not found.** Please start the process again with /edit_filter.")
         input_text = message.text.strip()
         try:
-            delete_indices = parse_button_numbers(input_text, len(filters_dict[keyword]['file_ids']))
+            file_list = filter_data['file_ids'].to_list()
+            delete_indices = parse_button_numbers(input_text, len(file_list))
             deleted_ids = []
             
             for i in delete_indices:
-                deleted_ids.append(filters_dict[keyword]['file_ids'][i-1])
+                deleted_ids.append(file_list[i-1])
 
             user_states[user_id] = {
                 "command": "confirm_file_channel_delete",
@@ -934,6 +2690,7 @@ async def message_handler(client, message):
                 "delete_indices": delete_indices,
                 "deleted_ids": deleted_ids
             }
+            mark_user_state(user_id)
             save_data()
 
             keyboard = InlineKeyboardMarkup([
@@ -947,10 +2704,13 @@ async def message_handler(client, message):
 
     elif state["command"] == "edit_file_set":
         keyword = state.get("keyword")
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None:
+            return await message.reply_text("❌ **Filter not found.** Please start the process again with /edit_filter.")
         input_text = message.text.strip()
         try:
-            swap_pairs, move_pairs = parse_swap_pairs(input_text, len(filters_dict[keyword]['file_ids']))
-            file_list = filters_dict[keyword]['file_ids']
+            file_list = filter_data['file_ids'].to_list()
+            swap_pairs, move_pairs = parse_swap_pairs(input_text, len(file_list))
             
             for i, j in swap_pairs:
                 file_list[i-1], file_list[j-1] = file_list[j-1], file_list[i-1]
@@ -959,11 +2719,12 @@ async def message_handler(client, message):
                 file_to_move = file_list.pop(i - 1)
                 file_list.insert(j - 1, file_to_move)
 
+            filter_data['file_ids'] = PackedIds(file_list)
+            filter_repo.save(keyword, filter_data)
             save_data()
             user_states[user_id] = {"command": "edit_file_menu", "keyword": keyword, "page": 1}
+            mark_user_state(user_id)
             save_data()
-            
-            filter_data = filters_dict[keyword]
             keyboard = create_paged_file_edit_buttons(keyword, filter_data['file_ids'], 1)
             await message.reply_text("🔄 **Files have been rearranged.**\n\n**Select an option below:**", reply_markup=keyboard)
 
@@ -976,15 +2737,17 @@ async def message_handler(client, message):
             if user_id in temp_files and temp_files[user_id]:
                 global_files[direction].extend(temp_files[user_id])
                 del temp_files[user_id]
+                mark_dirty("global_files")
                 save_data()
                 await message.reply_text(f"✅ **{direction.title()} Global Files saved!**")
             else:
                 await message.reply_text("❌ **No files were forwarded. Cancelled.**")
             del user_states[user_id]
+            mark_user_state(user_id)
             save_data()
         else:
             try:
-                new_msg = await message.copy(CHANNEL_ID)
+                new_msg = await call_with_retry(CHANNEL_ID, message.copy, CHANNEL_ID)
                 if user_id not in temp_files:
                     temp_files[user_id] = []
                 temp_files[user_id].append(new_msg.id)
@@ -994,10 +2757,11 @@ async def message_handler(client, message):
     
     elif state["command"] == "change_name_awaiting_old_name":
         old_keyword = message.text.lower().strip()
-        if old_keyword not in filters_dict:
+        if await filter_repo.get(old_keyword) is None:
             return await message.reply_text("❌ **Filter not found.** Please provide a valid filter name:")
         
         user_states[user_id] = {"command": "change_name_awaiting_new_name", "old_keyword": old_keyword}
+        mark_user_state(user_id)
         save_data()
         await message.reply_text("➡️ **Now, please provide the new name for the filter.**")
 
@@ -1005,36 +2769,41 @@ async def message_handler(client, message):
         old_keyword = state.get("old_keyword")
         new_keyword = message.text.lower().strip()
 
-        if not old_keyword or old_keyword not in filters_dict:
+        filter_data = await filter_repo.get(old_keyword) if old_keyword else None
+        if filter_data is None:
             del user_states[user_id]
+            mark_user_state(user_id)
             save_data()
             return await message.reply_text("❌ **Something went wrong. Please start the process again.**")
 
-        if new_keyword in filters_dict:
+        if await filter_repo.get(new_keyword) is not None:
             return await message.reply_text("⚠️ **A filter with this new name already exists.** Please provide a different name:")
         
-        # Change the key in the dictionary
-        filters_dict[new_keyword] = filters_dict.pop(old_keyword)
+        # Rename the stored document in place
+        filter_repo.rename(old_keyword, new_keyword, filter_data)
         
         # If the last filter was the one being changed, update its name too
         global last_filter
         if last_filter == old_keyword:
             last_filter = new_keyword
         
+        mark_dirty("last_filter")
         save_data()
 
-        await message.reply_text(f"✅ **The filter '{old_keyword}' has been successfully renamed to '{new_keyword}'.**\n🔗 New share link: `https://t.me/{(await client.get_me()).username}?start={new_keyword}`", parse_mode=ParseMode.MARKDOWN)
+        await message.reply_text(f"✅ **The filter '{old_keyword}' has been successfully renamed to '{new_keyword}'.**\n🔗 New share link: `{await share_link(new_keyword)}`", parse_mode=ParseMode.MARKDOWN)
 
         # Clear the user state
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
 
     elif state["command"] == "merge_awaiting_target_name":
         target_name = message.text.lower().strip()
-        if target_name in filters_dict:
+        if await filter_repo.get(target_name) is not None:
             return await message.reply_text("⚠️ **এই নামে একটি ফিল্টার ইতিমধ্যে আছে।** অনুগ্রহ করে অন্য একটি নাম দিন:")
         
         user_states[user_id] = {"command": "merge_awaiting_source_names", "target_name": target_name}
+        mark_user_state(user_id)
         save_data()
         await message.reply_text("➡️ **অনুগ্রহ করে যে সব ফিল্টার মার্জ করতে চান সেগুলির নাম দিন (কমা দিয়ে আলাদা করুন, যেমন: filter_01, filter_02):**")
 
@@ -1045,53 +2814,54 @@ async def message_handler(client, message):
 
         if not target_name:
             del user_states[user_id]
+            mark_user_state(user_id)
             save_data()
             return await message.reply_text("❌ **কিছু একটা ভুল হয়েছে।** অনুগ্রহ করে আবার /merge_filter কমান্ড দিয়ে শুরু করুন।")
         
         # Validate source filters and collect file IDs
         all_file_ids = []
+        all_media_groups = {}
         filters_to_delete = []
         for name in source_names:
-            if name not in filters_dict:
+            source_data = await filter_repo.get(name)
+            if source_data is None:
                 return await message.reply_text(f"❌ **ফিল্টার '{name}' পাওয়া যায়নি।** অনুগ্রহ করে সঠিক নাম দিন।")
             
-            if 'file_ids' in filters_dict[name] and filters_dict[name]['file_ids']:
-                all_file_ids.extend(filters_dict[name]['file_ids'])
+            if 'file_ids' in source_data and source_data['file_ids']:
+                all_file_ids.extend(source_data['file_ids'])
+                all_media_groups.update(source_data.get('media_groups', {}))
             
             filters_to_delete.append(name)
         
         if not all_file_ids:
             return await message.reply_text("❌ **মার্জ করার জন্য কোনো ফাইল পাওয়া যায়নি।**")
 
-        # Create the new merged filter
-        filters_dict[target_name] = {'message_text': None, 'button_data': [], 'file_ids': all_file_ids}
-        
         # Send the keyword and pin it
         try:
-            sent_msg = await app.send_message(CHANNEL_ID, f"#{target_name}\n[Merged Filter (মার্জ করা ফিল্টার)]")
+            sent_msg = await call_with_retry(CHANNEL_ID, app.send_message, CHANNEL_ID, f"#{target_name}\n[Merged Filter (মার্জ করা ফিল্টার)]")
             await app.pin_chat_message(CHANNEL_ID, sent_msg.id)
         except Exception as e:
             await message.reply_text(f"❌ **চ্যানেলে সেভ করতে সমস্যা হয়েছে:** {e}")
-            del filters_dict[target_name] # Rollback
-            save_data()
             return
 
-        # Delete old filters and their messages from channel
+        # Create the new merged filter and delete the old ones
+        filter_repo.save(target_name, {'message_text': None, 'button_data': [], 'file_ids': PackedIds(all_file_ids), 'media_groups': all_media_groups})
         for name in filters_to_delete:
-            if name in filters_dict:
-                del filters_dict[name]
+            filter_repo.delete(name)
                 
-        await message.reply_text(f"✅ **ফিল্টার সফলভাবে মার্জ হয়েছে!**\n🔗 শেয়ার লিংক: `https://t.me/{(await client.get_me()).username}?start={target_name}`", parse_mode=ParseMode.MARKDOWN)
+        await message.reply_text(f"✅ **ফিল্টার সফলভাবে মার্জ হয়েছে!**\n🔗 শেয়ার লিংক: `{await share_link(target_name)}`", parse_mode=ParseMode.MARKDOWN)
 
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
     
     elif state["command"] == "filter_data_awaiting_name":
         keyword = message.text.lower().strip()
-        if keyword not in filters_dict or filters_dict[keyword].get('type') != 'button_filter':
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is None or filter_data.get('type') != 'button_filter':
             return await message.reply_text("❌ **Filter not found or it is not a button filter.** Please provide a valid button filter name:")
         
-        filter_data = filters_dict[keyword]['button_data']
+        filter_data = filter_data['button_data']
         
         output_lines = []
         for button in filter_data:
@@ -1108,10 +2878,12 @@ async def message_handler(client, message):
         await message.reply_text(response_text, parse_mode=ParseMode.MARKDOWN)
         
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
 
     elif state["command"] == "awaiting_start_message_text":
         user_states[user_id] = {"command": "awaiting_start_message_buttons", "text": message.text}
+        mark_user_state(user_id)
         save_data()
         await message.reply_text(
             "➡️ **Now, please provide the button code for the start message.**\n"
@@ -1137,8 +2909,10 @@ async def message_handler(client, message):
             except Exception as e:
                 return await message.reply_text(f"❌ **Invalid button format:** {e}\nPlease try again:")
         
+        mark_dirty("start_message_data")
         save_data()
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
         await message.reply_text("✅ **Start message has been saved successfully!**")
 
@@ -1150,6 +2924,7 @@ async def message_handler(client, message):
         else:
             await message.reply_text("❌ **এটি কোনো চ্যানেল বা গ্রুপ থেকে ফরওয়ার্ড করা হয়নি।**")
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
         
     elif state["command"] == "cid_awaiting_owner":
@@ -1159,6 +2934,7 @@ async def message_handler(client, message):
         else:
             await message.reply_text("❌ **Owner ID পাওয়া যায়নি। (Privacy settings এর কারণে হতে পারে)**")
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
         
     elif state["command"] == "cid_awaiting_file":
@@ -1174,6 +2950,7 @@ async def message_handler(client, message):
             if user_id in temp_files:
                 del temp_files[user_id]
             del user_states[user_id]
+            mark_user_state(user_id)
             save_data()
         else:
             # চ্যানেল থেকে ফরওয়ার্ড করা মেসেজের অরিজিনাল আইডি নেওয়ার চেষ্টা করবে, না পেলে নতুন মেসেজ আইডি সেভ করবে
@@ -1191,6 +2968,7 @@ async def message_handler(client, message):
             
             if not any(c['id'] == chan_id for c in saved_send_channels):
                 saved_send_channels.append({'id': chan_id, 'name': chan_name})
+                mark_dirty("saved_send_channels")
                 save_data()
                 await message.reply_text(f"✅ **Channel '{chan_name}' added successfully!**")
             else:
@@ -1199,6 +2977,7 @@ async def message_handler(client, message):
             await message.reply_text("❌ **Please forward a message from a valid channel or group.**")
             
         del user_states[user_id]
+        mark_user_state(user_id)
         save_data()
 
 
@@ -1219,32 +2998,39 @@ async def channel_content_handler(client, message):
         if not keyword:
             return
         
-        if keyword in filters_dict and filters_dict[keyword].get('type') == 'button_filter':
-            await app.send_message(LOG_CHANNEL_ID, f"⚠️ **Filter '{keyword}' is a button filter. Files cannot be added to it.**")
+        filter_data = await filter_repo.get(keyword)
+        if filter_data is not None and filter_data.get('type') == 'button_filter':
+            log_event(f"⚠️ **Filter '{keyword}' is a button filter. Files cannot be added to it.**")
             return
             
         last_filter = keyword
-        if keyword not in filters_dict:
-            filters_dict[keyword] = {'message_text': None, 'button_data': [], 'file_ids': []}
-            msg_text = f"✅ **নতুন ফাইল ফিল্টার তৈরি হয়েছে!**\n🔗 শেয়ার লিংক: `https://t.me/{(await app.get_me()).username}?start={keyword}`"
-            await app.send_message(LOG_CHANNEL_ID, msg_text, parse_mode=ParseMode.MARKDOWN)
+        mark_dirty("last_filter")
+        if filter_data is None:
+            filter_repo.save(keyword, {'message_text': None, 'button_data': [], 'file_ids': PackedIds()})
+            msg_text = f"✅ **নতুন ফাইল ফিল্টার তৈরি হয়েছে!**\n🔗 শেয়ার লিংক: `{await share_link(keyword)}`"
+            log_event(msg_text)
             try:
-                await app.send_message(ADMIN_ID, msg_text, parse_mode=ParseMode.MARKDOWN)
+                await call_with_retry(ADMIN_ID, app.send_message, ADMIN_ID, msg_text, parse_mode=ParseMode.MARKDOWN)
             except Exception:
                 pass
         else:
-            await app.send_message(LOG_CHANNEL_ID, f"⚠️ **ফিল্টার '{keyword}' ইতিমধ্যে বিদ্যমান।**")
+            log_event(f"⚠️ **ফিল্টার '{keyword}' ইতিমধ্যে বিদ্যমান।**")
         save_data()
         return
 
     if message.media and last_filter:
-        if last_filter in filters_dict and filters_dict[last_filter].get('type') != 'button_filter':
-            if 'file_ids' not in filters_dict[last_filter]:
-                filters_dict[last_filter]['file_ids'] = []
-            filters_dict[last_filter]['file_ids'].append(message.id)
+        filter_data = await filter_repo.get(last_filter)
+        if filter_data is not None and filter_data.get('type') != 'button_filter':
+            if 'file_ids' not in filter_data:
+                filter_data['file_ids'] = PackedIds()
+            filter_data['file_ids'].append(message.id)
+            if message.media_group_id:
+                # অ্যালবামের মেসেজগুলো media_group_id অনুযায়ী একসাথে রাখা হয়
+                filter_data.setdefault('media_groups', {}).setdefault(str(message.media_group_id), []).append(message.id)
+            filter_repo.save(last_filter, filter_data)
             save_data()
         else:
-            await app.send_message(LOG_CHANNEL_ID, "⚠️ **কোনো সক্রিয় ফাইল ফিল্টার পাওয়া যায়নি বা এটি একটি বোতাম ফিল্টার।**")
+            log_event("⚠️ **কোনো সক্রিয় ফাইল ফিল্টার পাওয়া যায়নি বা এটি একটি বোতাম ফিল্টার।**")
 
 # চ্যানেল থেকে মেসেজ ডিলিট করার হ্যান্ডলার
 @app.on_deleted_messages(filters.channel & filters.chat(CHANNEL_ID))
@@ -1253,16 +3039,18 @@ async def channel_delete_handler(client, messages):
     for message in messages:
         if message.text:
             keyword = message.text.lower().replace('#', '').strip()
-            if keyword in filters_dict:
-                del filters_dict[keyword]
+            if await filter_repo.get(keyword) is not None:
+                filter_repo.delete(keyword)
                 if keyword == last_filter:
                     last_filter = None
                 
+                mark_dirty("last_filter")
                 save_data()
-                await app.send_message(LOG_CHANNEL_ID, f"🗑️ **ফিল্টার '{keyword}' সফলভাবে মুছে ফেলা হয়েছে।**")
+                log_event(f"🗑️ **ফিল্টার '{keyword}' সফলভাবে মুছে ফেলা হয়েছে।**")
             elif last_filter == keyword:
                 last_filter = None
-                await app.send_message(LOG_CHANNEL_ID, "📝 **দ্রষ্টব্য:** শেষ সক্রিয় ফিল্টারটি মুছে ফেলা হয়েছে।")
+                log_event("📝 **দ্রষ্টব্য:** শেষ সক্রিয় ফিল্টারটি মুছে ফেলা হয়েছে।")
+                mark_dirty("last_filter")
                 save_data()
 
 # --- Auto-delete Pin Message ---
@@ -1271,11 +3059,23 @@ async def service_message_handler(client, message):
     if message.pinned_message:
         try:
             await asyncio.sleep(5)
-            await app.delete_messages(CHANNEL_ID, message.id)
+            await call_with_retry(CHANNEL_ID, app.delete_messages, CHANNEL_ID, message.id)
             print(f"Successfully deleted pin service message {message.id}.")
         except Exception as e:
             print(f"Error deleting pin service message {message.id}: {e}")
 
+# join চ্যানেলগুলোর জয়েন/লিভ/কিক আপডেট থেকে membership index হালনাগাদ করা
+@app.on_chat_member_updated(filters.chat([channel['id'] for channel in join_channels]))
+async def join_channel_member_handler(client, update):
+    member = update.new_chat_member or update.old_chat_member
+    if member is None or member.user is None:
+        return
+    new_member = update.new_chat_member
+    is_member = new_member is not None and new_member.status in MEMBER_STATUSES and (new_member.status != ChatMemberStatus.RESTRICTED or new_member.is_member)
+    membership_cache.set(member.user.id, update.chat.id, is_member)
+    mark_membership(member.user.id, update.chat.id, is_member)
+    save_data()
+
 # /broadcast কমান্ড হ্যান্ডলার
 @app.on_message(filters.command("broadcast") & filters.private & filters.user(ADMIN_ID))
 async def broadcast_cmd(client, message):
@@ -1283,13 +3083,16 @@ async def broadcast_cmd(client, message):
         return await message.reply_text("📌 **Reply to a message** with `/broadcast`.")
     sent_count = 0
     failed_count = 0
-    total_users = len(user_list)
+    total_users = await users_collection.estimated_document_count()
     progress_msg = await message.reply_text(f"📢 **Broadcasting to {total_users} users...** (0/{total_users})")
-    for user_id in list(user_list):
+    # Server-side cursor, ইউজারদের BROADCAST_BATCH_SIZE করে আনা হয়; পুরো তালিকা মেমোরিতে রাখা হয় না
+    cursor = users_collection.find({}, {"_id": 1}).batch_size(BROADCAST_BATCH_SIZE)
+    async for user_doc in cursor:
+        user_id = user_doc["_id"]
         try:
             if user_id in banned_users:
                 continue
-            await message.reply_to_message.copy(user_id, protect_content=True)
+            await call_with_retry(user_id, message.reply_to_message.copy, user_id, protect_content=True)
             sent_count += 1
         except Exception as e:
             print(f"Failed to send broadcast to user {user_id}: {e}")
@@ -1301,7 +3104,6 @@ async def broadcast_cmd(client, message):
                 )
             except MessageNotModified:
                 pass
-        await asyncio.sleep(0.1)
     await progress_msg.edit_text(f"✅ **Broadcast complete!**\nSent to {sent_count} users.\nFailed to send to {failed_count} users.")
 
 # /delete কমান্ড হ্যান্ডলার
@@ -1312,11 +3114,12 @@ async def delete_cmd(client, message):
     if len(args) < 2:
         return await message.reply_text("📌 **Please provide a keyword to delete.**")
     keyword = args[1].lower()
-    if keyword in filters_dict:
-        del filters_dict[keyword]
+    if await filter_repo.get(keyword) is not None:
+        filter_repo.delete(keyword)
         if keyword == last_filter:
             last_filter = None
         
+        mark_dirty("last_filter")
         save_data()
         
         await message.reply_text(f"🗑️ **Filter '{keyword}' has been deleted from the database.**")
@@ -1328,6 +3131,7 @@ async def delete_cmd(client, message):
 async def restrict_cmd(client, message):
     global restrict_status
     restrict_status = not restrict_status
+    mark_dirty("restrict_status")
     save_data()
     status_text = "ON" if restrict_status else "OFF"
     await message.reply_text(f"🔒 **Message forwarding restriction is now {status_text}.**")
@@ -1343,6 +3147,7 @@ async def ban_cmd(client, message):
         if user_id_to_ban in banned_users:
             return await message.reply_text("⚠️ **This user is already banned.**")
         banned_users.add(user_id_to_ban)
+        mark_banned(user_id_to_ban, True)
         save_data()
         await message.reply_text(f"✅ **User `{user_id_to_ban}` has been banned.**", parse_mode=ParseMode.MARKDOWN)
     except ValueError:
@@ -1359,6 +3164,7 @@ async def unban_cmd(client, message):
         if user_id_to_unban not in banned_users:
             return await message.reply_text("⚠️ **This user is not banned.**")
         banned_users.remove(user_id_to_unban)
+        mark_banned(user_id_to_unban, False)
         save_data()
         await message.reply_text(f"✅ **User `{user_id_to_unban}` has been unbanned.**", parse_mode=ParseMode.MARKDOWN)
     except ValueError:
@@ -1376,6 +3182,7 @@ async def auto_delete_cmd(client, message):
     if time_str not in time_map:
         return await message.reply_text("❌ **ভুল সময় বিকল্প।**")
     autodelete_time = time_map[time_str]
+    mark_dirty("autodelete_time")
     save_data()
     if autodelete_time == 0:
         await message.reply_text(f"🗑️ **অটো-ডিলিট বন্ধ করা হয়েছে।**")
@@ -1388,19 +3195,13 @@ async def check_join_status_callback(client, callback_query):
     user_id = callback_query.from_user.id
     await callback_query.answer("Checking membership...", show_alert=True)
     
-    if await is_user_member(client, user_id):
+    missing_channels = await get_missing_channels(client, user_id, recheck=True)
+    if not missing_channels:
         await callback_query.message.edit_text("✅ **You have successfully joined!**\n\n**Please go back to the chat and send your link again.**", parse_mode=ParseMode.MARKDOWN)
     else:
-        buttons = []
-        for channel in join_channels:
-            try:
-                await client.get_chat_member(channel['id'], user_id)
-            except UserNotParticipant:
-                buttons.append([InlineKeyboardButton(f"✅ Join {channel['name']}", url=channel['link'])])
+        buttons = [[InlineKeyboardButton(f"✅ Join {channel['name']}", url=channel['link'])] for channel in missing_channels]
         
-        bot_username = (await client.get_me()).username
-        try_again_url = f"https://t.me/{bot_username}"
-        buttons.append([InlineKeyboardButton("🔄 Try Again", url=try_again_url)])
+        buttons.append([InlineKeyboardButton("🔄 Try Again", url=await share_link())])
         keyboard = InlineKeyboardMarkup(buttons)
         await callback_query.message.edit_text("❌ **You are still not a member.**", reply_markup=keyboard)
 
@@ -1416,8 +3217,8 @@ async def pagination_callback(client, callback_query):
     keyword = "_".join(keyword_parts)
     page = int(parts[-1])
 
-    if keyword in filters_dict:
-        filter_data = filters_dict[keyword]
+    filter_data = await filter_repo.get(keyword)
+    if filter_data is not None:
         if 'button_data' in filter_data and filter_data['button_data']:
             reply_text = filter_data.get('message_text', "Select an option:")
             reply_markup = create_paged_buttons(keyword, filter_data['button_data'], page)
@@ -1436,10 +3237,10 @@ async def edit_pagination_callback(client, callback_query):
     short_id = parts[1]
     page = int(parts[2])
 
-    keyword_to_find = next((k for k, v in filters_dict.items() if get_short_id(k) == short_id), None)
+    keyword_to_find = await filter_repo.find_by_short_id(short_id)
     
-    if keyword_to_find and keyword_to_find in filters_dict:
-        filter_data = filters_dict[keyword_to_find]
+    if keyword_to_find:
+        filter_data = await filter_repo.get(keyword_to_find)
         if 'button_data' in filter_data and filter_data['button_data']:
             reply_markup = create_paged_edit_buttons(keyword_to_find, filter_data['button_data'], page)
             try:
@@ -1458,10 +3259,10 @@ async def edit_file_pagination_callback(client, callback_query):
     short_id = parts[1]
     page = int(parts[2])
 
-    keyword_to_find = next((k for k, v in filters_dict.items() if get_short_id(k) == short_id), None)
+    keyword_to_find = await filter_repo.find_by_short_id(short_id)
     
-    if keyword_to_find and keyword_to_find in filters_dict:
-        filter_data = filters_dict[keyword_to_find]
+    if keyword_to_find:
+        filter_data = await filter_repo.get(keyword_to_find)
         reply_markup = create_paged_file_edit_buttons(keyword_to_find, filter_data['file_ids'], page)
         try:
             await query.edit_message_text("✅ **You are now editing the files for this filter.**\n\n**Select an option below:**", reply_markup=reply_markup)
@@ -1479,23 +3280,26 @@ async def edit_options_callback(client, callback_query):
     short_id = parts[2]
     user_id = query.from_user.id
     
-    keyword = next((k for k, v in filters_dict.items() if v.get('type') == 'button_filter' and get_short_id(k) == short_id), None)
+    keyword = await filter_repo.find_by_short_id(short_id, button_filter=True)
 
     if not keyword:
         return await query.edit_message_text("❌ **Filter not found.** Please start the process again with /editbutton.")
 
     if action == "add":
         user_states[user_id] = {"command": "edit_add_buttons", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please provide new button code (e.g., Button 01 = link1, [Button Name]):**")
     
     elif action == "delete":
         user_states[user_id] = {"command": "edit_delete_buttons", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please provide the button numbers to delete (e.g., `2, 4, 5, 7-10`):**")
 
     elif action == "set":
         user_states[user_id] = {"command": "edit_set_buttons", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please provide the button pairs to swap (e.g., `1-5, 3-8`) or move a single button (e.g., `6u-4`):**")
 
@@ -1510,23 +3314,26 @@ async def edit_file_options_callback(client, callback_query):
     short_id = parts[2]
     user_id = query.from_user.id
     
-    keyword = next((k for k, v in filters_dict.items() if v.get('type') != 'button_filter' and get_short_id(k) == short_id), None)
+    keyword = await filter_repo.find_by_short_id(short_id, button_filter=False)
 
     if not keyword:
         return await query.edit_message_text("❌ **Filter not found.** Please start the process again with /edit_filter.")
 
     if action == "add":
         user_states[user_id] = {"command": "edit_file_awaiting_forwards", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please forward messages to add or send ID (e.g., [id] 123,456). Send `ok` when done:**")
     
     elif action == "delete":
         user_states[user_id] = {"command": "edit_file_delete", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please provide the file numbers to delete (e.g., `2, 4, 5, 7-10`):**")
 
     elif action == "set":
         user_states[user_id] = {"command": "edit_file_set", "keyword": keyword}
+        mark_user_state(user_id)
         save_data()
         await query.edit_message_text("➡️ **Please provide the file pairs to swap (e.g., `1-5, 3-8`) or move a single file (e.g., `6u-4`):**")
 
@@ -1544,24 +3351,30 @@ async def editfile_delchan_callback(client, callback_query):
     delete_indices = state["delete_indices"]
     deleted_ids = state["deleted_ids"]
     
-    filters_dict[keyword]['file_ids'] = [
-        fid for i, fid in enumerate(filters_dict[keyword]['file_ids']) 
+    filter_data = await filter_repo.get(keyword)
+    if filter_data is None:
+        return await callback_query.answer("❌ Filter not found.", show_alert=True)
+    
+    filter_data['file_ids'] = PackedIds(
+        fid for i, fid in enumerate(filter_data['file_ids']) 
         if i + 1 not in delete_indices
-    ]
+    )
     
     if action == "yes":
         for file_id in deleted_ids:
-            try: await app.delete_messages(CHANNEL_ID, file_id)
+            try:
+                await call_with_retry(CHANNEL_ID, app.delete_messages, CHANNEL_ID, file_id)
             except: pass
         await callback_query.answer("✅ Files deleted from channel and removed from filter.")
     else:
         await callback_query.answer("✅ Files removed from filter only.")
         
+    filter_repo.save(keyword, filter_data)
     save_data()
     user_states[user_id] = {"command": "edit_file_menu", "keyword": keyword, "page": 1}
+    mark_user_state(user_id)
     save_data()
     
-    filter_data = filters_dict[keyword]
     keyboard = create_paged_file_edit_buttons(keyword, filter_data['file_ids'], 1)
     await callback_query.message.edit_text("🗑️ **Files have been updated.**\n\n**Select an option below:**", reply_markup=keyboard)
 
@@ -1575,6 +3388,7 @@ async def gf_add_callback(client, callback_query):
     direction = query.data.split('_')[-1]
     
     user_states[user_id] = {"command": f"gf_awaiting_{direction}"}
+    mark_user_state(user_id)
     save_data()
     await query.edit_message_text(f"➡️ **Please forward messages for {direction.title()} Global Files. Send `ok` when done:**")
 
@@ -1602,9 +3416,10 @@ async def gf_rm_file_callback(client, callback_query):
     file_list = global_files.get(direction, [])
     if idx < len(file_list):
         file_id = file_list.pop(idx)
+        mark_dirty("global_files")
         save_data()
         try:
-            await app.delete_messages(CHANNEL_ID, file_id)
+            await call_with_retry(CHANNEL_ID, app.delete_messages, CHANNEL_ID, file_id)
         except Exception:
             pass
         
@@ -1637,6 +3452,7 @@ async def cid_callback(client, callback_query):
     elif action == "channel":
         msg = "➡️ **Please forward a message from the Channel or Group.**"
         
+    mark_user_state(user_id)
     save_data()
     await callback_query.message.edit_text(msg)
 
@@ -1646,6 +3462,7 @@ async def del_schannel_callback(client, callback_query):
     chan_id = int(callback_query.data.split('_')[2])
     global saved_send_channels
     saved_send_channels = [c for c in saved_send_channels if c['id'] != chan_id]
+    mark_dirty("saved_send_channels")
     save_data()
     
     keyboard = []
@@ -1662,6 +3479,7 @@ async def del_schannel_callback(client, callback_query):
 async def add_schannel_callback(client, callback_query):
     user_id = callback_query.from_user.id
     user_states[user_id] = {"command": "awaiting_forward_schannel"}
+    mark_user_state(user_id)
     save_data()
     await callback_query.message.edit_text("➡️ **Please forward a message from the channel you want to add.**")
 
@@ -1676,7 +3494,7 @@ async def send_chan_callback(client, callback_query):
         return await callback_query.answer("❌ Context lost. Try /send again.", show_alert=True)
         
     keyword = state["keyword"]
-    filter_data = filters_dict.get(keyword)
+    filter_data = await filter_repo.get(keyword)
     if not filter_data or not filter_data.get('file_ids'):
         return await callback_query.answer("❌ Filter data missing.", show_alert=True)
         
@@ -1688,26 +3506,58 @@ async def send_chan_callback(client, callback_query):
         
     await callback_query.message.edit_text("⏳ **Sending files... Please wait.**")
     
-    file_ids_to_send = []
-    if 'up' in global_files and global_files['up']:
-        file_ids_to_send.extend(global_files['up'])
-    file_ids_to_send.extend(filter_data['file_ids'])
-    if 'down' in global_files and global_files['down']:
-        file_ids_to_send.extend(global_files['down'])
+    variant = get_delivery_plan(keyword, filter_data).full
         
-    for target_chat_id in targets:
-        for file_id in file_ids_to_send:
+    # প্রতিটি চ্যানেল scheduler-এ আলাদা owner, তাই একসাথে সর্বোচ্চ SEND_FANOUT_CONCURRENCY টি
+    # চ্যানেলে পাঠানো চলে এবং প্রতিটি চ্যানেলের নিজস্ব rate limit মানা হয়
+    channel_names = {c['id']: c['name'] for c in saved_send_channels}
+    jobs = {chat_id: resume_or_create_delivery(chat_id, keyword, variant, restrict_status) for chat_id in targets}
+    statuses = {chat_id: "queued" for chat_id in targets}
+    semaphore = asyncio.Semaphore(SEND_FANOUT_CONCURRENCY)
+
+    async def send_to_channel(chat_id):
+        async with semaphore:
+            statuses[chat_id] = "sending"
             try:
-                await app.copy_message(target_chat_id, CHANNEL_ID, file_id, protect_content=restrict_status)
-                await asyncio.sleep(0) 
-            except FloodWait as e:
-                await asyncio.sleep(e.value)
-                await app.copy_message(target_chat_id, CHANNEL_ID, file_id, protect_content=restrict_status)
+                await delivery_scheduler.run(chat_id, jobs[chat_id])
+                statuses[chat_id] = "done"
             except Exception as e:
-                print(f"Error copying to {target_chat_id}: {e}")
-    
-    await callback_query.message.edit_text(f"✅ **All files for '{keyword}' sent successfully!**")
-    del user_states[user_id]
+                print(f"Sending '{keyword}' to {chat_id} stopped at file {jobs[chat_id].files_done + 1}: {e}")
+                keep_for_resume(jobs[chat_id], keyword)
+                statuses[chat_id] = "interrupted"
+
+    status_icons = {"queued": "🕒", "sending": "⏳", "done": "✅", "interrupted": "⚠️"}
+    def render_progress(title):
+        lines = [title, ""]
+        for chat_id in targets:
+            job = jobs[chat_id]
+            line = f"{status_icons[statuses[chat_id]]} {channel_names.get(chat_id, chat_id)}: {job.files_done}/{len(job.file_ids)}"
+            failed = len(job.failed_ids) + job.missing_count
+            if failed:
+                line += f" ({failed} failed)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    fanout = asyncio.ensure_future(asyncio.gather(*(send_to_channel(chat_id) for chat_id in targets)))
+    while not fanout.done():
+        await asyncio.wait([fanout], timeout=SEND_PROGRESS_INTERVAL)
+        if not fanout.done():
+            try:
+                await callback_query.message.edit_text(render_progress(f"⏳ **Sending '{keyword}'...**"))
+            except MessageNotModified:
+                pass
+            except Exception as e:
+                print(f"Error updating send progress: {e}")
+    await fanout
+
+    interrupted = [chat_id for chat_id in targets if statuses[chat_id] == "interrupted"]
+    if interrupted:
+        title = f"⚠️ **Sending '{keyword}' finished with {len(interrupted)} interrupted channel(s).** Run `/send {keyword}` again to continue from where it stopped."
+    else:
+        title = f"✅ **All files for '{keyword}' sent successfully!**"
+    await callback_query.message.edit_text(render_progress(title))
+    user_states.pop(user_id, None)
+    mark_user_state(user_id)
     save_data()
 
 # Start message callback handlers (New)
@@ -1716,6 +3566,7 @@ async def add_start_message_callback(client, callback_query):
     user_id = callback_query.from_user.id
     await callback_query.answer()
     user_states[user_id] = {"command": "awaiting_start_message_text"}
+    mark_user_state(user_id)
     save_data()
     await callback_query.message.edit_text("➡️ **Please send the new start message text.**")
 
@@ -1755,6 +3606,7 @@ async def delete_start_message_callback(client, callback_query):
     global start_message_data
     await callback_query.answer("Deleting start message...", show_alert=True)
     start_message_data = {}
+    mark_dirty("start_message_data")
     save_data()
     await callback_query.edit_message_text("🗑️ **Start message has been successfully deleted.**")
     
@@ -1770,19 +3622,54 @@ async def ap_toggle_callback(client, callback_query):
     elif action == "restrict":
         admin_powers['admin_restrict'] = not admin_powers.get('admin_restrict', False)
         
+    mark_dirty("admin_powers")
     save_data()
     await callback_query.message.edit_reply_markup(reply_markup=get_admin_power_keyboard())
 
 # --- Run Services ---
+async def main():
+    if load_snapshot():
+        open_mongodb()
+        journal.start()
+        await replay_journal()
+        asyncio.create_task(reconcile_with_mongodb())
+        if not known_users_loaded:
+            asyncio.create_task(load_known_users())
+    else:
+        await connect_to_mongodb()
+        await load_data()
+        journal.start()
+        await replay_journal()
+        persist_ready.set()
+        asyncio.create_task(load_known_users())
+    start_persistence()
+    start_snapshots()
+    delivery_scheduler.start()
+    await app.start()
+    start_bot_identity()
+    start_auto_delete()
+    start_log_sink()
+    print("Starting TA File Share Bot...")
+    # idle() SIGINT/SIGTERM/SIGABRT পেলে ফিরে আসে, তারপর queue flush করা হয়
+    await idle()
+    try:
+        stop_auto_delete()
+        stop_bot_identity()
+        await stop_log_sink()
+        await app.stop()
+        await delivery_scheduler.stop()
+        await stop_persistence()
+        await stop_snapshots()
+    finally:
+        # journal-এর buffer-এ থাকা entry-গুলো যেকোনো অবস্থায় ডিস্কে লিখে বন্ধ করা
+        await journal.stop()
+
 def run_flask_and_pyrogram():
-    connect_to_mongodb()
-    load_data()
-    flask_thread = threading.Thread(target=lambda: app_flask.run(host="0.0.0.0", port=PORT, use_reloader=False))
+    flask_thread = threading.Thread(target=lambda: app_flask.run(host="0.0.0.0", port=PORT, use_reloader=False), daemon=True)
     flask_thread.start()
-    ping_thread = threading.Thread(target=ping_service)
+    ping_thread = threading.Thread(target=ping_service, daemon=True)
     ping_thread.start()
-    print("Starting TA File Share Bot...")
-    app.run()
+    app.run(main())
 
 if __name__ == "__main__":
     run_flask_and_pyrogram()
@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+import pytest
+
+for module in ("pyrogram", "motor", "pymongo", "flask", "dotenv", "bson"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("PORT", "8080")
+os.environ.setdefault("JOURNAL_DIR", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+# main-এর pymongo অপারেশনগুলোর বদলে সহজ tuple, যাতে একটি in-memory কালেকশনে চালানো যায়
+Op = namedtuple("Op", "kind filter doc")
+
+class DuplicateKey(Exception):
+    pass
+
+# keyword-এর unique index সহ filters কালেকশন
+class FakeFilters:
+    def __init__(self, docs):
+        self.docs = dict(docs)
+
+    def apply(self, op):
+        keyword = op.filter["keyword"]
+        if op.kind == "update":
+            if keyword in self.docs:
+                new_keyword = op.doc["$set"]["keyword"]
+                if new_keyword in self.docs:
+                    raise DuplicateKey(new_keyword)
+                self.docs[new_keyword] = self.docs.pop(keyword)
+        elif op.kind == "replace":
+            self.docs[keyword] = op.doc["data"]
+        else:
+            self.docs.pop(keyword, None)
+
+class NullJournal:
+    def append(self, entry):
+        pass
+
+@pytest.fixture
+def state(monkeypatch):
+    monkeypatch.setattr(main, "journal", NullJournal())
+    monkeypatch.setattr(main, "UpdateOne", lambda f, d, upsert=False: Op("update", f, d))
+    monkeypatch.setattr(main, "ReplaceOne", lambda f, d, upsert=False: Op("replace", f, d))
+    monkeypatch.setattr(main, "DeleteOne", lambda f: Op("delete", f, None))
+    monkeypatch.setattr(main, "filter_to_doc", lambda keyword, filter_data: {"data": filter_data})
+    for name in ("dirty_filters", "deleted_filters", "flushing_filters"):
+        monkeypatch.setattr(main, name, set())
+    monkeypatch.setattr(main, "renamed_filters", {})
+    monkeypatch.setattr(main, "filter_repo", main.FilterRepository(100, 3600))
+    return main.filter_repo
+
+def make_filter(value):
+    return {'message_text': None, 'button_data': [], 'file_ids': [value]}
+
+def stored(repo, docs):
+    for keyword, value in docs.items():
+        repo.remember(keyword, make_filter(value))
+    return FakeFilters({keyword: make_filter(value) for keyword, value in docs.items()})
+
+def flush(collection):
+    rename_ops, filter_ops = main.build_filter_ops()
+    for op in rename_ops + filter_ops:
+        collection.apply(op)
+    main.take_dirty()
+    return rename_ops
+
+def rename(repo, old_keyword, new_keyword):
+    repo.rename(old_keyword, new_keyword, repo.peek(old_keyword))
+
+def test_rename_is_a_single_update(state):
+    collection = stored(state, {"a": 1})
+    rename(state, "a", "b")
+    rename_ops = flush(collection)
+    assert [op.kind for op in rename_ops].count("update") == 1
+    assert collection.docs == {"b": make_filter(1)}
+
+def test_recreated_source_survives_delete_of_renamed_filter(state):
+    collection = stored(state, {"c": 1})
+    rename(state, "c", "d")
+    state.save("c", make_filter(2))
+    state.delete("d")
+    flush(collection)
+    assert collection.docs == {"c": make_filter(2)}
+
+def test_delete_frees_target_before_rename(state):
+    collection = stored(state, {"a": 1, "c": 2})
+    rename(state, "a", "d")
+    rename(state, "c", "a")
+    state.delete("d")
+    flush(collection)
+    assert collection.docs == {"a": make_filter(2)}
+
+def test_rename_back_after_recreate_and_delete(state):
+    collection = stored(state, {"d": 1})
+    rename(state, "d", "b")
+    state.save("d", make_filter(2))
+    state.delete("d")
+    rename(state, "b", "d")
+    flush(collection)
+    assert collection.docs == {"d": make_filter(1)}
+
+def test_swap_cycle(state):
+    collection = stored(state, {"a": 1, "b": 2})
+    rename(state, "a", "t")
+    rename(state, "b", "a")
+    rename(state, "t", "b")
+    flush(collection)
+    assert collection.docs == {"a": make_filter(2), "b": make_filter(1)}
+
+def test_retry_after_failed_flush(state):
+    collection = stored(state, {"a": 1, "b": 2})
+    state.delete("b")
+    rename(state, "a", "b")
+    rename_ops, filter_ops = main.build_filter_ops()
+    snapshot = main.take_dirty()
+    for op in rename_ops:
+        collection.apply(op)
+    main.restore_dirty(snapshot)
+    flush(collection)
+    assert collection.docs == {"b": make_filter(1)}
+    assert not main.has_dirty()